@@ -274,7 +274,9 @@ const SongRecommenderPage = () => {
                                             <div className="sr-analysis-content">
                                                 <p><strong>Mood:</strong> {imageAnalysis.mood}</p>
                                                 <p><strong>Energy Level:</strong> {Math.round(imageAnalysis.energy_level * 100)}%</p>
-                                                <p><strong>Detected:</strong> {imageAnalysis.predictions[0].label}</p>
+                                                {imageAnalysis.predictions?.length > 0 && (
+                                                    <p><strong>Detected:</strong> {imageAnalysis.predictions[0].label}</p>
+                                                )}
                                             </div>
                                         </div>
                                     )}
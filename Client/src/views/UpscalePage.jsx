@@ -43,22 +43,22 @@ const UpscalePage = () => {
       formData.append('image', blob, 'image.png');
       formData.append('settings', JSON.stringify(settings));
 
+      // The server streams the PNG itself; no base64 round trip
       const res = await fetch(`${import.meta.env.VITE_SERVER_URL}/upscale`, {
         method: 'POST',
         body: formData,
+        headers: { Accept: 'image/png' },
       });
-      const responseData = await res.text();
       if (!res.ok) {
-        throw new Error(`Server error: ${responseData}`);
+        throw new Error(`Server error: ${await res.text()}`);
       }
 
-      const data = JSON.parse(responseData);
-      if (data.image) {
-        setEnhancedImage(`data:image/png;base64,${data.image}`);
-        setStatus(data.message || 'Image upscaled successfully!');
-      } else {
-        throw new Error('Invalid response format');
+      const imageBlob = await res.blob();
+      if (enhancedImage) {
+        URL.revokeObjectURL(enhancedImage);
       }
+      setEnhancedImage(URL.createObjectURL(imageBlob));
+      setStatus('Image upscaled successfully!');
     } catch (error) {
       setStatus(`Error: ${error.message}`);
       console.error('Enhancement error:', error);
@@ -1,72 +1,688 @@
 import torch
+import torch.nn.functional as F
 import numpy as np
 import sys
 import io
 import json
 import traceback
 import os
+import inspect
+import pickle
+import threading
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
 from PIL import Image
 from torchvision.transforms import ToTensor, ToPILImage
 
+# CPU budget of this process, set per worker by the Node pool: intra-op threads, inter-op threads
+# and optionally the cores to run on (comma-separated ids). Unset means torch's defaults, all cores.
+NUM_THREADS = int(os.environ.get('UPSCALE_NUM_THREADS', 0))
+INTEROP_THREADS = int(os.environ.get('UPSCALE_INTEROP_THREADS', 1))
+CPU_AFFINITY = os.environ.get('UPSCALE_CPU_AFFINITY', '')
+
+# Models already loaded by this process, keyed by (device, tier, scale). Each key is loaded and
+# calibrated under its own lock, so concurrent first requests for it load it only once.
+_loaded_models = {}
+_model_locks = {}
+_model_locks_guard = threading.Lock()
+
+# SwinIR presets per quality/speed tier and native scale, best quality first. 'auto' picks a tier
+# for a latency target from the cost model, calibrated on this machine when a model is loaded.
+MODEL_TIERS = {
+    'quality': {
+        4: {'checkpoint': '001_classicalSR_DIV2K_s48w8_SwinIR-M_x4.pth', 'img_size': 64, 'embed_dim': 180,
+            'depths': [6, 6, 6, 6, 6, 6], 'num_heads': [6, 6, 6, 6, 6, 6], 'upsampler': 'nearest+conv'},
+        2: {'checkpoint': '001_classicalSR_DIV2K_s48w8_SwinIR-M_x2.pth', 'img_size': 48, 'embed_dim': 180,
+            'depths': [6, 6, 6, 6, 6, 6], 'num_heads': [6, 6, 6, 6, 6, 6], 'upsampler': 'pixelshuffle'},
+    },
+    'fast': {
+        4: {'checkpoint': '002_lightweightSR_DIV2K_s64w8_SwinIR-S_x4.pth', 'img_size': 64, 'embed_dim': 60,
+            'depths': [6, 6, 6, 6], 'num_heads': [6, 6, 6, 6], 'upsampler': 'pixelshuffledirect'},
+        2: {'checkpoint': '002_lightweightSR_DIV2K_s64w8_SwinIR-S_x2.pth', 'img_size': 64, 'embed_dim': 60,
+            'depths': [6, 6, 6, 6], 'num_heads': [6, 6, 6, 6], 'upsampler': 'pixelshuffledirect'},
+    },
+}
+
+# Tier used when a request does not name one: 'quality', 'fast' or 'auto' (pick by latency target)
+DEFAULT_TIER = os.environ.get('UPSCALE_TIER', 'quality')
+DEFAULT_SCALE = 4
+LATENCY_TARGET_MS = float(os.environ.get('UPSCALE_LATENCY_TARGET_MS', 15000))
+
+# How checkpoints are read: 'auto' (memory-mapped when possible, pages shared across workers),
+# 'safetensors', 'torch-mmap' or 'copy' (plain torch.load into private memory)
+WEIGHTS_LOADING = os.environ.get('UPSCALE_WEIGHTS_LOADING', 'auto')
+
+# Tiled inference defaults (input pixels). A tile size of 0 runs the whole image in one pass.
+DEFAULT_TILE_SIZE = int(os.environ.get('UPSCALE_TILE_SIZE', 256))
+DEFAULT_TILE_OVERLAP = int(os.environ.get('UPSCALE_TILE_OVERLAP', 32))
+MIN_TILE_SIZE, MAX_TILE_SIZE = 32, 1024
+
+# Pre-add the relative position bias to each shifted-window mask (faster, ~nW*nH*N*N floats per layer)
+FOLD_ATTENTION_MASKS = os.environ.get('UPSCALE_FOLD_MASKS', '0') == '1'
+
+# WindowAttention implementation: 'eager' or 'sdpa' (torch.nn.functional.scaled_dot_product_attention)
+ATTENTION_BACKEND = os.environ.get('UPSCALE_ATTENTION', 'eager')
+
+# Numeric precision on CPU: 'fp32', 'int8' (dynamic int8 nn.Linear) or 'bf16' (autocast where supported).
+# Check quality first with benchmarks/quality_check.py.
+PRECISION = os.environ.get('UPSCALE_PRECISION', 'fp32')
+
+# Inference engine: 'eager', or fixed-shape 'torchscript'/'onnx' artifacts built by export_swinir.py.
+# Artifacts are exported from the fp32 model, so they require UPSCALE_PRECISION=fp32.
+ENGINE = os.environ.get('UPSCALE_ENGINE', 'eager')
+
+# Worker-mode concurrency: requests handled at once and how their tiles are batched together
+MAX_INFLIGHT_REQUESTS = int(os.environ.get('UPSCALE_MAX_INFLIGHT', 4))
+BATCH_SIZE = int(os.environ.get('UPSCALE_BATCH_SIZE', 4))
+BATCH_WAIT_MS = float(os.environ.get('UPSCALE_BATCH_WAIT_MS', 10))
+
+# Disk cache of finished upscales shared by all workers; UPSCALE_CACHE_MAX_MB=0 disables it
+CACHE_DIR = os.environ.get('UPSCALE_CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'cache')
+CACHE_MAX_MB = float(os.environ.get('UPSCALE_CACHE_MAX_MB', 1024))
+
+# Admission control: requests whose predicted cost (cost_model.py, FLOPs calibrated on this CPU)
+# exceeds a budget are handled per UPSCALE_OVER_BUDGET: 'downgrade' (smaller tiles, then the fast
+# tier), 'queue' (over-time requests run one at a time) or 'reject'. A budget of 0 is unlimited.
+MAX_LATENCY_MS = float(os.environ.get('UPSCALE_MAX_LATENCY_MS', 120000))
+MAX_MEMORY_MB = float(os.environ.get('UPSCALE_MAX_MEMORY_MB', 2048))
+OVER_BUDGET = os.environ.get('UPSCALE_OVER_BUDGET', 'downgrade')
+_large_request_lane = threading.Semaphore(1)
+
+# Adaptive tiling: tiles whose detail score (max over 16px blocks of the mean luma gradient
+# magnitude, 0-1) is below this threshold are upscaled with bicubic interpolation instead of SwinIR.
+# 0 disables it; tune with benchmarks/bench_adaptive.py.
+DETAIL_THRESHOLD = float(os.environ.get('UPSCALE_DETAIL_THRESHOLD', 0))
+DETAIL_BLOCK_SIZE = 16
+LUMA_WEIGHTS = torch.tensor([0.2989, 0.5870, 0.1140])
+
+# Output rows per IDAT chunk when a finished image is encoded in one go (resized outputs)
+PNG_STRIP_ROWS = 64
+
+# Apply the CPU budget; must run before the first torch op, since the inter-op pool is fixed then
+def apply_cpu_budget():
+    if CPU_AFFINITY and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, {int(core) for core in CPU_AFFINITY.split(',')})
+        except (OSError, ValueError) as e:
+            print(f"Could not pin to cores {CPU_AFFINITY}: {e}", file=sys.stderr)
+    if NUM_THREADS > 0:
+        torch.set_num_threads(NUM_THREADS)
+    if INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(INTEROP_THREADS)
+        except RuntimeError:
+            # already started (e.g. imported after other torch work); keep the current pool
+            pass
+
+# Identity of a checkpoint file's contents (size and modification time), recorded by
+# convert_weights.py in the .safetensors metadata and part of the result cache key
+def checkpoint_identity(path):
+    stat = os.stat(path)
+    return {'source_size': str(stat.st_size), 'source_mtime_ns': str(stat.st_mtime_ns)}
+
+# Whether a .safetensors file was converted from the checkpoint as it is now; a replaced .pth
+# makes the old conversion stale
+def _safetensors_matches(safetensors_path, model_path):
+    from safetensors import safe_open
+    with safe_open(safetensors_path, framework='pt') as f:
+        metadata = f.metadata() or {}
+    identity = checkpoint_identity(model_path)
+    return all(metadata.get(name) == value for name, value in identity.items())
+
+# Read a checkpoint's weights. Returns (state_dict, mapped); mapped tensors are backed by the file's
+# page cache, so every worker on a node shares one read-only copy. 'auto' prefers a .safetensors file
+# next to the .pth (written by convert_weights.py), then torch's own mmap loading of the .pth.
+# A .safetensors file that was not converted from the current .pth is ignored.
+def load_weights(model_path, mode=None):
+    mode = mode or WEIGHTS_LOADING
+    safetensors_path = os.path.splitext(model_path)[0] + '.safetensors'
+    if mode == 'safetensors' or (mode == 'auto' and os.path.exists(safetensors_path)):
+        try:
+            from safetensors.torch import load_file
+            if _safetensors_matches(safetensors_path, model_path):
+                return load_file(safetensors_path, device='cpu'), True
+            print(f"{safetensors_path} was not converted from the current {os.path.basename(model_path)}, "
+                  f"loading the .pth checkpoint; rerun convert_weights.py", file=sys.stderr)
+        except ImportError:
+            print("safetensors is not installed, loading the .pth checkpoint", file=sys.stderr)
+
+    if mode in ('auto', 'torch-mmap') and 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters:
+        try:
+            checkpoint = torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+            return checkpoint['params'], True
+        except (TypeError, RuntimeError, pickle.UnpicklingError):
+            # older torch, or a legacy (non-zip) checkpoint that cannot be mapped
+            pass
+
+    checkpoint = torch.load(model_path, map_location='cpu')
+    return checkpoint['params'], False
+
+def _checkpoint_path(tier, scale):
+    # Define model path relative to script location
+    return os.path.join(os.path.dirname(__file__), MODEL_TIERS[tier][scale]['checkpoint'])
+
 # Load the SwinIR model
-def load_swinir_model():
+def load_swinir_model(tier='quality', scale=4, weights_loading=None):
     from models.network_swinir import SwinIR as net
-    model = net(upscale=4, in_chans=3, img_size=64, window_size=8,
-                img_range=1., depths=[6, 6, 6, 6, 6, 6], embed_dim=180, num_heads=[6, 6, 6, 6, 6, 6],
-                mlp_ratio=2, upsampler='nearest+conv', resi_connection='1conv')
-    
-    # Define model path relative to script location
-    model_path = os.path.join(os.path.dirname(__file__), '001_classicalSR_DIV2K_s48w8_SwinIR-M_x4.pth')
-    
+    preset = MODEL_TIERS[tier][scale]
+    model = net(upscale=scale, in_chans=3, img_size=preset['img_size'], window_size=8,
+                img_range=1., depths=preset['depths'], embed_dim=preset['embed_dim'], num_heads=preset['num_heads'],
+                mlp_ratio=2, upsampler=preset['upsampler'], resi_connection='1conv')
+    model.tier = tier
+
+    model_path = _checkpoint_path(tier, scale)
+
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found at: {model_path}")
-    
-    checkpoint = torch.load(model_path)
-    model.load_state_dict(checkpoint['params'], strict=True)
+
+    state_dict, mapped = load_weights(model_path, weights_loading)
+    if mapped:
+        # adopt the mapped tensors as parameters instead of copying them into freshly allocated ones
+        model.load_state_dict(state_dict, strict=True, assign=True)
+    else:
+        model.load_state_dict(state_dict, strict=True)
     model.eval()
+    model.freeze_for_inference(fold_masks=FOLD_ATTENTION_MASKS)
+    model.set_attention_backend(ATTENTION_BACKEND)
     return model
 
-# Upscale an image using SwinIR
-def upscale_image(image_data):
+# CPUs with native bf16 matmuls; elsewhere autocast to bf16 is emulated and slower than fp32
+def cpu_supports_bf16():
+    capability = getattr(torch.backends.cpu, 'get_cpu_capability', lambda: '')()
+    return 'AVX512' in capability or 'AMX' in capability
+
+# Convert a loaded fp32 model to the requested precision
+def apply_precision(model, precision):
+    model.autocast_dtype = None
+    if precision == 'fp32':
+        return model
+    if precision == 'int8':
+        # WindowAttention.qkv/proj and Mlp.fc1/fc2 are the only nn.Linear layers in SwinIR
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == 'bf16':
+        if cpu_supports_bf16():
+            model.autocast_dtype = torch.bfloat16
+        else:
+            print("bf16 is not supported natively on this CPU, running fp32", file=sys.stderr)
+        return model
+    raise ValueError(f"Unknown precision: {precision}")
+
+# Return the SwinIR model for a device/tier/scale, loading it only on first use
+def get_model(device, tier='quality', scale=4):
+    key = (device, tier, scale)
+    model = _loaded_models.get(key)
+    if model is not None:
+        return model
+    with _model_locks_guard:
+        lock = _model_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _loaded_models:
+            if device == 'cpu' and ENGINE != 'eager' and PRECISION != 'fp32':
+                # tiles matching an artifact would silently run in fp32
+                raise ValueError(f"UPSCALE_ENGINE={ENGINE} runs fp32 artifacts and cannot be combined with "
+                                 f"UPSCALE_PRECISION={PRECISION}; use the eager engine for {PRECISION}")
+            model = load_swinir_model(tier, scale).to(device)
+            if device == 'cpu':
+                from export_swinir import load_engine
+                model = load_engine(apply_precision(model, PRECISION), ENGINE)
+            # Warms the model up and measures its throughput for the cost model
+            from cost_model import calibrate_throughput
+            calibrate_throughput(model, run_model, device=device)
+            _loaded_models[key] = model
+    return _loaded_models[key]
+
+# Native model scale for a requested scale; other factors are reached by resizing the model output
+def native_scale(scale):
+    return 2 if scale <= 2 else 4
+
+# Tiers whose checkpoint for this native scale is installed, best quality first
+def available_tiers(scale):
+    return [name for name in MODEL_TIERS if os.path.exists(_checkpoint_path(name, scale))]
+
+# Predicted cost (cost_model.estimate_cost) of upscaling a width x height image with a tier and tile
+# size; loads and calibrates the model if needed. streaming: the output is encoded as rows finish.
+def estimate_request(width, height, tier, scale, tile_size, tile_overlap, device, batcher=None, streaming=False):
+    from cost_model import estimate_cost
+
+    model = get_model(device, tier, scale)
+    tiles_in_flight = batcher.max_batch_size if batcher is not None else 1
+    effective_tile = _effective_tile_size(model, tile_size) if tile_size else 0
+    overlap = _effective_tile_overlap(effective_tile, tile_overlap)
+    return estimate_cost(model, height, width, effective_tile, overlap, _tile_starts, tiles_in_flight, streaming)
+
+# Pick the tier for a request: a named tier as-is, or for 'auto' the best installed tier whose
+# calibrated latency estimate fits the target (the same estimate admit() checks), else the fastest
+def select_tier(tier, scale, width, height, tile_size, tile_overlap, device, batcher=None, streaming=False,
+                latency_target_ms=LATENCY_TARGET_MS):
+    if tier in MODEL_TIERS:
+        return tier
+    if tier != 'auto':
+        raise ValueError(f"Unknown tier: {tier}")
+    available = available_tiers(scale)
+    if not available:
+        raise FileNotFoundError(f"No model checkpoints found for x{scale}")
+    for name in available:
+        estimate = estimate_request(width, height, name, scale, tile_size, tile_overlap, device, batcher, streaming)
+        if estimate['latency_ms'] is None or estimate['latency_ms'] <= latency_target_ms:
+            return name
+    return available[-1]
+
+# Check a request against the latency/memory budgets and return (tier, tile_size, estimate, lane).
+# lane is a lock to hold while running, for requests queued behind each other; raises
+# OverBudgetError when no acceptable mode fits. streaming: the output is encoded as rows finish.
+def admit(width, height, tier, scale, tile_size, tile_overlap, device, batcher=None, streaming=False):
+    from cost_model import OverBudgetError, over_budget
+
+    max_memory_bytes = MAX_MEMORY_MB * 2 ** 20
+
+    def estimate(candidate_tier, candidate_tile):
+        return estimate_request(width, height, candidate_tier, scale, candidate_tile, tile_overlap, device,
+                                batcher, streaming)
+
+    requested = estimate(tier, tile_size)
+    reasons = over_budget(requested, MAX_LATENCY_MS, max_memory_bytes)
+    if not reasons:
+        return tier, tile_size, requested, None
+
+    if OVER_BUDGET == 'queue' and not over_budget(requested, 0, max_memory_bytes):
+        return tier, tile_size, requested, _large_request_lane
+
+    if OVER_BUDGET == 'downgrade':
+        # Smaller tiles bound memory; the fast tier cuts time
+        tile_sizes = [tile_size] + [t for t in (256, 128, 64) if not tile_size or t < tile_size]
+        tiers = [tier] + [name for name in ('fast',) if name != tier and name in available_tiers(scale)]
+        for candidate_tier in tiers:
+            for candidate_tile in tile_sizes:
+                if (candidate_tier, candidate_tile) == (tier, tile_size):
+                    continue
+                candidate = estimate(candidate_tier, candidate_tile)
+                if not over_budget(candidate, MAX_LATENCY_MS, max_memory_bytes):
+                    print(f"Downgraded {width}x{height} x{scale} from {tier}/{tile_size} to "
+                          f"{candidate_tier}/{candidate_tile}: {'; '.join(reasons)}", file=sys.stderr)
+                    return candidate_tier, candidate_tile, candidate, None
+
+    raise OverBudgetError(f"Image of {width}x{height} at x{scale} is too large for this server: "
+                          f"{'; '.join(reasons)}. Try a smaller image or a lower scale.", requested)
+
+# Forward pass honouring the model's reduced-precision setting; always returns fp32
+def run_model(model, x):
+    autocast_dtype = getattr(model, 'autocast_dtype', None)
+    if autocast_dtype is None:
+        return model(x)
+    with torch.autocast(device_type=x.device.type, dtype=autocast_dtype):
+        return model(x).float()
+
+# Settings arrive as a dict from the worker protocol or as (possibly double-encoded) JSON on the CLI
+def parse_settings(raw):
+    while isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return {}
+    return raw if isinstance(raw, dict) else {}
+
+# Linear ramp weights for one tile edge: rising over the overlap on sides that have a neighbour
+def _edge_ramp(length, overlap, ramp_start, ramp_end):
+    weights = torch.ones(length)
+    if overlap > 0:
+        ramp = (torch.arange(overlap, dtype=torch.float32) + 0.5) / overlap
+        if ramp_start:
+            weights[:overlap] = ramp
+        if ramp_end:
+            weights[-overlap:] = torch.minimum(weights[-overlap:], ramp.flip(0))
+    return weights
+
+# Start offsets of tiles along one axis; the last tile is aligned to the image edge
+def _tile_starts(size, tile_size, overlap):
+    if size <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, size - tile_size, stride))
+    starts.append(size - tile_size)
+    return starts
+
+# Run one model input directly, or hand it to the worker's micro-batcher when one is running
+def _submit_tile(model, tile, batcher):
+    if batcher is not None:
+        return batcher.submit((model, tile), (id(model), tuple(tile.shape)))
+    future = Future()
+    future.set_result(run_model(model, tile))
+    return future
+
+# How much detail a (1, 3, H, W) tile has: central-difference gradient magnitude of its luma
+# (the edge metric of image_analysis.py), averaged over small blocks, highest block wins so one
+# sharp edge in an otherwise flat tile still counts
+def tile_detail(tile):
+    gray = (tile[0].cpu() * LUMA_WEIGHTS[:, None, None]).sum(0)
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return float('inf')
+    gx = gray[1:-1, 2:] - gray[1:-1, :-2]
+    gy = gray[2:, 1:-1] - gray[:-2, 1:-1]
+    magnitude = (gx * gx + gy * gy).sqrt()[None, None]
+    return F.avg_pool2d(magnitude, DETAIL_BLOCK_SIZE, ceil_mode=True).max().item()
+
+# Submit a tile to SwinIR, or interpolate it right away when it is flat enough for the threshold.
+# counts, when given, tallies the tiles that took each path.
+def _route_tile(model, tile, batcher, detail_threshold=0, counts=None):
+    if detail_threshold and tile_detail(tile) < detail_threshold:
+        path = 'interpolated'
+        future = Future()
+        future.set_result(F.interpolate(tile, scale_factor=model.upscale, mode='bicubic',
+                                        align_corners=False).clamp_(0, 1))
+    else:
+        path = 'swinir'
+        future = _submit_tile(model, tile, batcher)
+    if counts is not None:
+        counts[path] = counts.get(path, 0) + 1
+    return future
+
+# Clamp a requested tile size and round it down to a multiple of the model's window size
+def _effective_tile_size(model, tile_size):
+    tile_size = max(MIN_TILE_SIZE, min(MAX_TILE_SIZE, int(tile_size)))
+    return tile_size - tile_size % model.window_size
+
+# Clamp a requested overlap to at most half the (effective) tile size, so tiles always advance
+def _effective_tile_overlap(tile_size, tile_overlap):
+    return max(0, min(int(tile_overlap), tile_size // 2))
+
+# Run the model tile by tile so activation memory is bounded by the tile size, not the image size.
+# Each tile goes through model.forward, which pads it with check_image_size and crops the result,
+# and overlapping tile outputs are blended with linear ramps so no seams show.
+# on_rows(start_row, rows) is called with each band of final output rows as soon as every tile
+# covering it has been blended, top to bottom, so the caller can encode while the rest still runs.
+# The blend buffers then only hold one band of tile rows, so memory does not grow with the image,
+# and nothing is returned; without on_rows the whole output is accumulated and returned.
+# With a detail_threshold, flat tiles are interpolated instead (see _route_tile); the ramps blend
+# them with their SwinIR neighbours the same way.
+def tiled_forward(model, img_tensor, tile_size, tile_overlap, batcher=None, on_rows=None,
+                  detail_threshold=0, tile_counts=None):
+    _, channels, height, width = img_tensor.shape
+    scale = model.upscale
+    tile_size = _effective_tile_size(model, tile_size)
+    tile_overlap = _effective_tile_overlap(tile_size, tile_overlap)
+
+    if height <= tile_size and width <= tile_size:
+        output = _route_tile(model, img_tensor, batcher, detail_threshold, tile_counts).result()
+        if on_rows is not None:
+            on_rows(0, output)
+            return None
+        return output
+
+    # Rows from `top` down are held in the buffers. When streaming, rows are dropped once handed out:
+    # a tile starts at or below the first unfinished row, so one tile height of rows is always enough
+    buffer_rows = tile_size * scale if on_rows is not None else height * scale
+    output = torch.zeros(1, channels, buffer_rows, width * scale)
+    weight = torch.zeros(1, 1, buffer_rows, width * scale)
+    top = 0
+    positions = [(y, x)
+                 for y in _tile_starts(height, tile_size, tile_overlap)
+                 for x in _tile_starts(width, tile_size, tile_overlap)]
+
+    # Rows above the current tile row's start receive no further tiles, so they can be normalized
+    # and handed out; `finished` is the first output row that has not been yet
+    finished = 0
+
+    def finish_rows(end):
+        nonlocal finished, top
+        if end <= finished:
+            return
+        start, finished = finished, end
+        rows = output[..., start - top:end - top, :]
+        rows.div_(weight[..., start - top:end - top, :])
+        if on_rows is None:
+            return
+        on_rows(start, rows)
+        # Move the unfinished rows to the front of the band and clear the rest
+        kept = buffer_rows - (end - top)
+        if kept > 0:
+            output[..., :kept, :] = output[..., end - top:, :].clone()
+            weight[..., :kept, :] = weight[..., end - top:, :].clone()
+        output[..., max(kept, 0):, :].zero_()
+        weight[..., max(kept, 0):, :].zero_()
+        top = end
+
+    def blend(y, x, future):
+        finish_rows(y * scale)
+        tile_output = future.result().cpu()
+        th, tw = tile_output.shape[2:]
+        ramp_h = _edge_ramp(th, tile_overlap * scale, y > 0, y + tile_size < height)
+        ramp_w = _edge_ramp(tw, tile_overlap * scale, x > 0, x + tile_size < width)
+        tile_weight = ramp_h[:, None] * ramp_w[None, :]
+        oy, ox = y * scale - top, x * scale
+        output[..., oy:oy + th, ox:ox + tw] += tile_output * tile_weight
+        weight[..., oy:oy + th, ox:ox + tw] += tile_weight
+
+    # Keep at most one batch worth of tiles in flight so finished outputs never pile up
+    max_in_flight = batcher.max_batch_size if batcher is not None else 1
+    in_flight = deque()
+    for y, x in positions:
+        tile = img_tensor[..., y:y + tile_size, x:x + tile_size]
+        in_flight.append((y, x, _route_tile(model, tile, batcher, detail_threshold, tile_counts)))
+        if len(in_flight) >= max_in_flight:
+            blend(*in_flight.popleft())
+    while in_flight:
+        blend(*in_flight.popleft())
+    finish_rows(height * scale)
+
+    return output if on_rows is None else None
+
+# Build a batcher that stacks same-shaped tiles for the same model from concurrent requests
+# into one forward pass
+def create_tile_batcher(max_batch_size, max_wait_ms):
+    from micro_batcher import MicroBatcher
+
+    def run_batch(items):
+        model = items[0][0]
+        with torch.no_grad():
+            return list(run_model(model, torch.cat([tile for _, tile in items], dim=0)).split(1, dim=0))
+
+    return MicroBatcher(run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                        name='upscale-batcher')
+
+# Convert a (1, C, H, W) tensor in [0, 1] to uint8 (H, W, C) rows, the same way ToPILImage does
+def _to_uint8_rows(tensor):
+    return tensor.squeeze(0).clamp(0, 1).mul(255).byte().permute(1, 2, 0).cpu().numpy()
+
+# Upscale an image using SwinIR and stream it as PNG: write(bytes) is called with each encoded
+# piece as soon as the tile rows it covers are finished. With a result cache, a repeated input is
+# copied from disk before the model is loaded or the request is checked against the budgets.
+# Returns a report: the tier used, the cache outcome ('hit', 'miss' or None) and how many tiles
+# went through SwinIR or interpolation.
+def upscale_image_to(image_data, write, settings=None, batcher=None, cache=None):
+    from cost_model import OverBudgetError
+    from png_stream import PngStreamWriter
+    from upscale_cache import copy_cached
+
+    settings = settings or {}
+    cache_writers = []
     try:
-        # Load and convert image
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-        img_np = np.array(image)
+        # Only the header is read here; pixels are decoded after the cache lookup
+        image = Image.open(io.BytesIO(image_data))
+
+        # Resolve scale and tier: requested scale in [1, 8], tier 'quality'/'fast'/'auto'
+        scale = min(8.0, max(1.0, float(settings.get('scale', DEFAULT_SCALE))))
+        model_scale = native_scale(scale)
+        requested_tier = settings.get('tier', DEFAULT_TIER)
+        if requested_tier not in MODEL_TIERS and requested_tier != 'auto':
+            raise ValueError(f"Unknown tier: {requested_tier}")
+
+        # Tile settings come from the client, possibly as strings; 0 runs the whole image in one pass
+        tile_size = int(float(settings.get('tile_size', DEFAULT_TILE_SIZE)))
+        if tile_size:
+            tile_size = max(MIN_TILE_SIZE, min(MAX_TILE_SIZE, tile_size))
+        tile_overlap = max(0, min(MAX_TILE_SIZE // 2, int(float(settings.get('tile_overlap', DEFAULT_TILE_OVERLAP)))))
+        detail_threshold = float(settings.get('detail_threshold', DETAIL_THRESHOLD))
+        report = {'tier': requested_tier, 'cache': None, 'tiles': {}}
+
+        # Everything that changes the output pixels is part of the cache key, including the checkpoint's
+        # size and mtime, so replacing the weights retires their old results
+        def cache_key(key_tier, key_tile_size):
+            return cache.key(image_data, {
+                'checkpoint': MODEL_TIERS[key_tier][model_scale]['checkpoint'],
+                'weights': checkpoint_identity(_checkpoint_path(key_tier, model_scale)), 'scale': scale,
+                'tile_size': key_tile_size, 'tile_overlap': tile_overlap, 'precision': PRECISION,
+                'engine': ENGINE, 'attention': ATTENTION_BACKEND, 'detail_threshold': detail_threshold,
+            })
+
+        if cache is not None:
+            # For 'auto' a finished result of any installed tier will do, best quality first: it
+            # costs nothing to serve, and picking the tier would mean loading and calibrating models
+            candidates = [requested_tier] if requested_tier in MODEL_TIERS else available_tiers(model_scale)
+            cached = cache.open(*[cache_key(name, tile_size) for name in candidates])
+            if cached is not None:
+                copy_cached(cached, write)
+                report['cache'] = 'hit'
+                return report
 
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model = load_swinir_model().to(device)
+        streaming = scale == model_scale
+        tier = select_tier(requested_tier, model_scale, image.width, image.height, tile_size, tile_overlap,
+                           device, batcher, streaming, float(settings.get('latency_ms', LATENCY_TARGET_MS)))
+        requested = (tier, tile_size)
+        tier, tile_size, _, lane = admit(image.width, image.height, tier, model_scale, tile_size, tile_overlap,
+                                         device, batcher, streaming)
+        report['tier'] = tier
+
+        if cache is not None:
+            # A downgraded result is also what a request for the downgraded settings would get
+            keys = [cache_key(*requested)] + ([cache_key(tier, tile_size)] if (tier, tile_size) != requested else [])
+            cache_writers = [cache.writer(key) for key in keys]
+            send = write
+
+            def write(data):
+                for cache_writer in cache_writers:
+                    cache_writer.write(data)
+                send(data)
+
+        image = image.convert("RGB")
+        img_np = np.array(image)
+
+        model = get_model(device, tier, model_scale)
 
         # Preprocess the image
         img_tensor = ToTensor()(image).unsqueeze(0).to(device)
 
-        # Upscale the image
-        with torch.no_grad():
-            output_tensor = model(img_tensor)
+        # Upscale the image, tile by tile for anything larger than one tile
+        # At the model's native scale rows are encoded as tile rows finish; any other scale needs
+        # the whole output for the Lanczos resize first and is encoded afterwards
+        png = None
+        on_rows = None
+        if scale == model_scale:
+            png = PngStreamWriter(write, image.width * model_scale, image.height * model_scale)
+            on_rows = lambda _, rows: png.write_rows(_to_uint8_rows(rows))
 
-        # Convert the output tensor to an image
-        output_image = ToPILImage()(output_tensor.squeeze(0).cpu().clamp(0, 1))
+        with torch.no_grad(), lane or nullcontext():
+            if tile_size:
+                output_tensor = tiled_forward(model, img_tensor, tile_size, tile_overlap, batcher, on_rows,
+                                              detail_threshold, report['tiles'])
+            else:
+                output_tensor = _route_tile(model, img_tensor, batcher, detail_threshold, report['tiles']).result()
+                if on_rows is not None:
+                    on_rows(0, output_tensor)
 
-        # Save the upscaled image to a buffer
-        buffer = io.BytesIO()
-        output_image.save(buffer, format='PNG')
-        return buffer.getvalue()
+        if png is None:
+            output_image = ToPILImage()(output_tensor.squeeze(0).cpu().clamp(0, 1))
+            target_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            output_rows = np.asarray(output_image.resize(target_size, Image.LANCZOS))
+            png = PngStreamWriter(write, *target_size)
+            for start in range(0, target_size[1], PNG_STRIP_ROWS):
+                png.write_rows(output_rows[start:start + PNG_STRIP_ROWS])
+        png.close()
 
+        for cache_writer in cache_writers:
+            cache_writer.commit()
+        if cache_writers:
+            report['cache'] = 'miss'
+        return report
+
+    except OverBudgetError:
+        raise
     except Exception as e:
+        for cache_writer in cache_writers:
+            cache_writer.discard()
         error_message = f"Error in SwinIR upscaling: {str(e)}"
         print(error_message, file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         raise RuntimeError(error_message)
 
+# Upscale an image using SwinIR and return the whole PNG
+def upscale_image(image_data, settings=None, batcher=None, cache=None):
+    buffer = io.BytesIO()
+    upscale_image_to(image_data, buffer.write, settings, batcher, cache)
+    return buffer.getvalue()
+
+# Run as a long-lived worker: load the model once, then answer framed requests on stdin/stdout
+def serve():
+    from cost_model import OverBudgetError
+    from upscale_cache import create_result_cache
+    from worker_protocol import claim_stdio, read_frame
+
+    frame_in, frame_out = claim_stdio()
+    apply_cpu_budget()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = get_model(device, DEFAULT_TIER if DEFAULT_TIER in MODEL_TIERS else 'quality', DEFAULT_SCALE)
+
+    # Build the shifted-window masks for full tiles now instead of on the first request
+    if DEFAULT_TILE_SIZE:
+        tile_size = _effective_tile_size(model, DEFAULT_TILE_SIZE)
+        model.precompute_attn_masks([(tile_size, tile_size)], device)
+
+    batcher = create_tile_batcher(BATCH_SIZE, BATCH_WAIT_MS)
+    cache = create_result_cache(CACHE_DIR, CACHE_MAX_MB)
+    executor = ThreadPoolExecutor(max_workers=MAX_INFLIGHT_REQUESTS, thread_name_prefix='upscale-request')
+
+    def handle(header, payload):
+        request_id = header.get('id')
+        try:
+            settings = parse_settings(header.get('settings'))
+            if header.get('stream'):
+                # PNG pieces go out as 'chunk' frames; the empty 'result' frame marks the end
+                write = lambda data: frame_out.write({'type': 'chunk', 'id': request_id}, data)
+                buffer = None
+            else:
+                buffer = io.BytesIO()
+                write = buffer.write
+            report = upscale_image_to(payload, write, settings, batcher, cache)
+            frame_out.write({'type': 'result', 'id': request_id, **report,
+                             'cache_stats': cache.stats() if cache is not None else None},
+                            buffer.getvalue() if buffer is not None else b'')
+        except OverBudgetError as e:
+            frame_out.write({'type': 'error', 'id': request_id, 'error': str(e), 'code': 'over_budget',
+                             'estimate': e.estimate})
+        except Exception as e:
+            frame_out.write({'type': 'error', 'id': request_id, 'error': str(e)})
+
+    frame_out.write({'type': 'ready', 'pid': os.getpid(), 'max_inflight': MAX_INFLIGHT_REQUESTS})
+    print(f"Upscale worker {os.getpid()} ready on {device} with {torch.get_num_threads()} threads"
+          + (f" on cores {CPU_AFFINITY}" if CPU_AFFINITY else ''), file=sys.stderr)
+
+    while True:
+        frame = read_frame(frame_in)
+        if frame is None:
+            break
+        header, payload = frame
+        executor.submit(handle, header, payload)
+
+    executor.shutdown(wait=True)
+
 if __name__ == "__main__":
+    if '--serve' in sys.argv[1:]:
+        serve()
+        sys.exit(0)
+
+    apply_cpu_budget()
     try:
         # Read image data from stdin
         image_data = sys.stdin.buffer.read()
 
-        # Upscale the image
-        result = upscale_image(image_data)
-
-        # Write the result to stdout
-        sys.stdout.buffer.write(result)
+        # Upscale the image, writing the PNG to stdout as it is encoded
+        settings = parse_settings(sys.argv[1]) if len(sys.argv) > 1 else {}
+        from upscale_cache import create_result_cache
+        upscale_image_to(image_data, sys.stdout.buffer.write, settings,
+                         cache=create_result_cache(CACHE_DIR, CACHE_MAX_MB))
+        sys.stdout.buffer.flush()
 
     except Exception as e:
         error_message = f"Error: {str(e)}"
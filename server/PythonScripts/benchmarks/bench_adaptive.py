@@ -0,0 +1,71 @@
+"""Tune UPSCALE_DETAIL_THRESHOLD: interpolated tile fraction, speed and quality per threshold.
+
+    python PythonScripts/benchmarks/bench_adaptive.py --thresholds 0.01 0.02 0.05 --tier fast
+
+Every image of the corpus (synthetic by default, or --images DIR) is upscaled with SwinIR on every
+tile, then once per threshold with flat tiles interpolated. For each threshold the script prints
+the fraction of tiles that were interpolated, the speedup, and the worst PSNR/SSIM against the
+all-SwinIR output. Pick the highest threshold whose worst case you can live with.
+"""
+import argparse
+import json
+
+import torch
+
+from common import load_corpus, parse_sizes, psnr, ssim, timed, to_tensor
+
+import Upscale  # noqa: E402  (path set up by common)
+
+
+def upscale_all(model, corpus, tile_size, tile_overlap, threshold):
+    outputs, seconds, counts = [], 0.0, {}
+    with torch.no_grad():
+        for _, image in corpus:
+            output, elapsed = timed(Upscale.tiled_forward, model, to_tensor(image), tile_size, tile_overlap,
+                                    detail_threshold=threshold, tile_counts=counts)
+            outputs.append(output)
+            seconds += elapsed
+    return outputs, seconds, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.01, 0.02, 0.05, 0.1])
+    parser.add_argument('--tier', choices=sorted(Upscale.MODEL_TIERS), default='fast')
+    parser.add_argument('--scale', type=int, choices=[2, 4], default=4)
+    parser.add_argument('--images', help='directory of real test images instead of the synthetic corpus')
+    parser.add_argument('--sizes', nargs='+', default=['256x192'], help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--tile-size', type=int, default=64)
+    parser.add_argument('--tile-overlap', type=int, default=16)
+    parser.add_argument('--json', help='write the full report to this file')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images, parse_sizes(args.sizes))
+    model = Upscale.get_model('cpu', args.tier, args.scale)
+    references, reference_seconds, reference_counts = upscale_all(model, corpus, args.tile_size,
+                                                                  args.tile_overlap, 0)
+    print(f"all SwinIR: {reference_seconds:.2f}s for {len(corpus)} images, {reference_counts['swinir']} tiles")
+
+    report = {'reference_seconds': reference_seconds, 'thresholds': {}}
+    print(f"{'threshold':>10} {'interpolated':>13} {'speedup':>8} {'worst PSNR':>11} {'worst SSIM':>11}")
+    for threshold in args.thresholds:
+        outputs, seconds, counts = upscale_all(model, corpus, args.tile_size, args.tile_overlap, threshold)
+        rows = [{'image': name, 'psnr': psnr(reference, output), 'ssim': ssim(reference, output)}
+                for (name, _), reference, output in zip(corpus, references, outputs)]
+        total = sum(counts.values())
+        fraction = counts.get('interpolated', 0) / total
+        worst_psnr = min(row['psnr'] for row in rows)
+        worst_ssim = min(row['ssim'] for row in rows)
+        print(f"{threshold:>10.3f} {fraction:>12.0%} {reference_seconds / seconds:>7.2f}x "
+              f"{worst_psnr:>8.2f} dB {worst_ssim:>11.4f}")
+        report['thresholds'][threshold] = {
+            'interpolated_fraction': fraction, 'seconds': seconds, 'images': rows
+        }
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
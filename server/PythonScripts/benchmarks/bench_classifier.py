@@ -0,0 +1,87 @@
+"""Agreement and speed of the converted TFLite / ONNX classifiers against the Keras model.
+
+    python PythonScripts/convert_classifier.py --format tflite onnx --precision int8
+    python PythonScripts/benchmarks/bench_classifier.py --backends keras tflite onnx --images uploads/
+
+Every image of the corpus (synthetic by default, or --images DIR; real photos say much more) is
+classified by each backend. Reported per backend: load time, ms per image at batch size 1, how
+often its top-1 label matches Keras, the mean overlap of the top-5 sets, and the largest
+probability difference on the Keras top-1 class. The mood mapping only reads labels whose score
+is above 0.15-0.2, so top-5 agreement matters more than exact probabilities.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from common import load_corpus, parse_sizes, timed
+
+from classifier_backends import load_classifier, preprocess_mode  # noqa: E402  (path set up by common)
+
+
+def prepare(corpus, classifier):
+    height, width = classifier.input_shape[1:3]
+    arrays = []
+    for _, image in corpus:
+        array = np.asarray(image.resize((width, height)), dtype=np.float32)
+        arrays.append(array / 127.5 - 1.0 if preprocess_mode(classifier.name) == 'tf' else array)
+    return arrays
+
+
+def top_k(probabilities, k=5):
+    return np.argsort(-probabilities, axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['keras', 'tflite', 'onnx'])
+    parser.add_argument('--model', default='efficientnetb2')
+    parser.add_argument('--precision', default='int8')
+    parser.add_argument('--images', help='directory of real test images instead of the synthetic corpus')
+    parser.add_argument('--sizes', nargs='+', default=['320x320', '640x480'],
+                        help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images, parse_sizes(args.sizes))
+    reference = None
+    results = []
+    print(f"{len(corpus)} images")
+    print(f"{'backend':<8} {'load s':>7} {'ms/image':>9} {'top-1 agree':>12} {'top-5 overlap':>14} {'max prob diff':>14}")
+    # Keras is always run first: it is the reference the others are compared to
+    for backend in ['keras'] + [b for b in args.backends if b != 'keras']:
+        start = time.perf_counter()
+        classifier = load_classifier(backend, args.model, args.precision)
+        load_seconds = time.perf_counter() - start
+        if classifier.backend != backend:
+            print(f"{backend:<8} skipped: not available")
+            continue
+        arrays = prepare(corpus, classifier)
+        classifier(arrays[0][None])
+        outputs, seconds = [], 0.0
+        for array in arrays:
+            output, elapsed = timed(classifier, array[None])
+            outputs.append(output[0])
+            seconds += elapsed
+        probabilities = np.stack(outputs)
+        if reference is None:
+            reference = probabilities
+        reference_top = top_k(reference)
+        ours = top_k(probabilities)
+        top1 = float(np.mean(ours[:, 0] == reference_top[:, 0]))
+        overlap = float(np.mean([len(set(a) & set(b)) / 5 for a, b in zip(ours, reference_top)]))
+        rows = np.arange(len(reference))
+        prob_diff = float(np.abs(probabilities[rows, reference_top[:, 0]] - reference[rows, reference_top[:, 0]]).max())
+        ms = seconds / len(arrays) * 1000
+        print(f"{backend:<8} {load_seconds:>7.2f} {ms:>9.1f} {top1:>12.1%} {overlap:>14.1%} {prob_diff:>14.4f}")
+        results.append({'backend': backend, 'load_seconds': load_seconds, 'ms_per_image': ms,
+                        'top1_agreement': top1, 'top5_overlap': overlap, 'max_prob_diff': prob_diff})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Time the reduced analysis decode against a full decode, for JPEG and PNG uploads.
+
+    python PythonScripts/benchmarks/bench_decode.py --sizes 1920x1080 4000x3000 --working-size 1024
+
+Every image of the corpus (synthetic by default, or --images DIR) is encoded as JPEG and PNG and
+decoded twice: in full, as the analyzer used to, and with image_features.decode_for_analysis.
+Reported: decode ms, the bitmap MB each way allocates (decoded image plus the array handed to the
+feature stages), and how far brightness, saturation and contrast move from the full decode.
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from common import load_corpus, parse_sizes
+
+import image_features  # noqa: E402  (path set up by common)
+
+CLASSIFIER_SIZE = (260, 260)
+
+
+def color_summary(pixels, working_size):
+    stats = image_features.color_statistics(image_features.working_image(pixels, working_size))
+    return np.array([stats['brightness'], stats['saturation'], np.mean(stats['rgb_std']) / 255.0])
+
+
+def timed_ms(fn, *args, repeats=3):
+    result = fn(*args)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(*args)
+    return result, (time.perf_counter() - start) / repeats * 1000
+
+
+def full_decode(data):
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    return image, np.array(image)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='directory of real test images instead of the synthetic corpus')
+    parser.add_argument('--sizes', nargs='+', default=['1920x1080', '4000x3000'],
+                        help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--working-size', type=int, default=1024)
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality')
+    args = parser.parse_args()
+
+    print(f"{'image':<22} {'format':<6} {'full ms':>8} {'reduced ms':>11} {'full MB':>8} {'reduced MB':>11} "
+          f"{'decoded':>11} {'max diff':>9}")
+    for name, image in load_corpus(args.images, parse_sizes(args.sizes)):
+        for image_format in ('JPEG', 'PNG'):
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format, quality=args.quality)
+            data = buffer.getvalue()
+
+            (full, full_pixels), full_ms = timed_ms(full_decode, data)
+            (reduced, pixels), reduced_ms = timed_ms(image_features.decode_for_analysis, data,
+                                                     args.working_size, CLASSIFIER_SIZE)
+            full_mb = (full.width * full.height * 3 + full_pixels.nbytes) / 2 ** 20
+            reduced_mb = (reduced.width * reduced.height * 3 + pixels.nbytes) / 2 ** 20
+            diff = np.abs(color_summary(pixels, args.working_size)
+                          - color_summary(full_pixels, args.working_size)).max()
+            print(f"{name:<22} {image_format:<6} {full_ms:>8.1f} {reduced_ms:>11.1f} {full_mb:>8.1f} "
+                  f"{reduced_mb:>11.1f} {f'{reduced.width}x{reduced.height}':>11} {diff:>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
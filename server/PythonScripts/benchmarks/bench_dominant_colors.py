@@ -0,0 +1,67 @@
+"""Check and time the histogram dominant-color extraction against the np.unique version it replaced.
+
+    python PythonScripts/benchmarks/bench_dominant_colors.py --sizes 640x480 1920x1080 4000x3000 --strides 1 2 4
+
+For every size and pattern of the synthetic corpus, the dominant colors are computed the old way
+(quantize every pixel, np.unique over rows) and with image_features.dominant_colors at every
+stride. Stride 1 must return exactly the same colors and percentages. Reported: ms per image for
+each method, and for the sampled strides the largest percentage error against the exact result.
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from common import parse_sizes, synthetic_corpus, timed
+
+from image_features import dominant_colors  # noqa: E402  (path set up by common)
+
+
+def unique_dominant_colors(image_np, n_colors=5):
+    """The original EnhancedImageAnalyzer.find_dominant_colors."""
+    pixels = image_np.reshape(-1, 3)
+    quantized = (pixels // 16) * 16
+    unique_colors, counts = np.unique(quantized, axis=0, return_counts=True)
+    sorted_idx = np.argsort(-counts, kind='stable')
+    return unique_colors[sorted_idx[:n_colors]], counts[sorted_idx[:n_colors]] / len(pixels)
+
+
+def percentage_error(reference, result):
+    """Largest difference in coverage over the reference colors (a color missing from result counts as 0)."""
+    found = {tuple(color): share for color, share in zip(result[0].tolist(), result[1])}
+    return max(abs(share - found.get(tuple(color), 0.0)) for color, share in zip(reference[0].tolist(), reference[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1920x1080', '4000x3000'],
+                        help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--strides', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--colors', type=int, default=5)
+    args = parser.parse_args()
+
+    strides = sorted(set(args.strides) | {1})
+    failed = False
+    print(f"{'image':<22} {'np.unique ms':>13} " + ' '.join(f"{f'stride {s} ms':>12}" for s in strides)
+          + ' ' + ' '.join(f"{f'err @{s}':>8}" for s in strides if s > 1) + f" {'exact':>6}")
+    for name, image in synthetic_corpus(parse_sizes(args.sizes)):
+        image_np = np.asarray(image)
+        reference, unique_seconds = timed(unique_dominant_colors, image_np, args.colors)
+        times, errors, exact = [], [], None
+        for stride in strides:
+            result, seconds = timed(dominant_colors, image_np, args.colors, stride)
+            times.append(seconds * 1000)
+            if stride == 1:
+                exact = (np.array_equal(reference[0], result[0])
+                         and np.allclose(reference[1], result[1], rtol=0, atol=1e-12))
+            else:
+                errors.append(percentage_error(reference, result))
+        failed = failed or not exact
+        print(f"{name:<22} {unique_seconds * 1000:>13.1f} " + ' '.join(f"{t:>12.1f}" for t in times)
+              + ' ' + ' '.join(f"{e:>8.4f}" for e in errors) + f" {str(exact):>6}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compare upscaler latency across the eager, TorchScript and ONNX Runtime engines.
+
+    python PythonScripts/benchmarks/bench_engines.py --tile-sizes 64 128 --engines eager torchscript onnx
+
+Artifacts for the requested tile sizes are exported to a temporary directory first, so the
+comparison always uses the current code and weights. Engines whose runtime is missing are skipped.
+"""
+import argparse
+import tempfile
+
+import torch
+
+from common import timed
+
+import Upscale  # noqa: E402  (path set up by common)
+from export_swinir import ExportedEngine, export_model  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=['eager', 'torchscript', 'onnx'])
+    parser.add_argument('--tile-sizes', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = Upscale.load_swinir_model()
+    print(f"threads={args.threads} batch={args.batch}")
+    print(f"{'engine':<12} {'tile':>6} {'ms/tile':>10} {'vs eager':>9} {'max abs diff':>13}")
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        for tile in args.tile_sizes:
+            x = torch.rand(args.batch, 3, tile, tile)
+            with torch.no_grad():
+                reference = model(x)
+            eager_ms = None
+            for engine in args.engines:
+                if engine == 'eager':
+                    runner = model
+                else:
+                    try:
+                        export_model(model, engine, [tile], [args.batch], artifact_dir)
+                        runner = ExportedEngine(model, engine, artifact_dir)
+                    except (ImportError, RuntimeError) as e:
+                        print(f"{engine:<12} {tile:>6} skipped: {e}")
+                        continue
+
+                with torch.no_grad():
+                    output = runner(x)
+                    total = sum(timed(runner, x)[1] for _ in range(args.repeats))
+                ms = total / args.repeats / args.batch * 1000
+                eager_ms = ms if engine == 'eager' else eager_ms
+                speedup = f"{eager_ms / ms:.2f}x" if eager_ms else '-'
+                diff = (output - reference).abs().max().item()
+                print(f"{engine:<12} {tile:>6} {ms:>10.1f} {speedup:>9} {diff:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Compare the working-resolution color/texture statistics with the full-resolution code they replaced.
+
+    python PythonScripts/benchmarks/bench_features.py --sizes 1920x1080 4000x3000 --working-sizes 0 1024 512
+
+For every image of the corpus (synthetic by default, or --images DIR), the statistics are computed
+the old way (HSV through boolean masks, full-size float64 gradients, a Python loop over 16x16
+blocks) and with image_features at every working size, 0 meaning full resolution. Reported per
+method: ms per image, peak memory allocated by NumPy while it ran (tracemalloc), and the statistic
+that differs most from the old result. Note the old code accumulated its HSV means in float32, which
+is itself off by a few hundredths on 12 MP images. Edge density is measured at image_features.EDGE_SIDE
+whatever the working size: it matches the old result up to that size, and stays that of the picture
+at EDGE_SIDE above it, where the old per-pixel value fell with every added pixel.
+"""
+import argparse
+import json
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from common import load_corpus, parse_sizes, timed
+
+import image_features  # noqa: E402  (path set up by common)
+
+STATISTICS = ['brightness', 'saturation', 'contrast', 'edge_density', 'texture_contrast', 'texture_roughness']
+
+
+def reference_statistics(image_np):
+    """The original EnhancedImageAnalyzer color and texture computations, reduced to their statistics."""
+    def rgb_to_hsv(rgb_img):
+        r, g, b = rgb_img[..., 0], rgb_img[..., 1], rgb_img[..., 2]
+        r, g, b = r / 255.0, g / 255.0, b / 255.0
+        maxc = np.maximum(np.maximum(r, g), b)
+        minc = np.minimum(np.minimum(r, g), b)
+        v = maxc
+        deltac = maxc - minc
+        s = np.zeros_like(deltac)
+        s[maxc != 0] = deltac[maxc != 0] / maxc[maxc != 0]
+        h = np.zeros_like(deltac)
+        rc = np.zeros_like(deltac)
+        rc[deltac != 0] = (maxc[deltac != 0] - r[deltac != 0]) / deltac[deltac != 0]
+        gc = np.zeros_like(deltac)
+        gc[deltac != 0] = (maxc[deltac != 0] - g[deltac != 0]) / deltac[deltac != 0]
+        bc = np.zeros_like(deltac)
+        bc[deltac != 0] = (maxc[deltac != 0] - b[deltac != 0]) / deltac[deltac != 0]
+        h[b == maxc] = 4.0 + gc[b == maxc] - rc[b == maxc]
+        h[g == maxc] = 2.0 + rc[g == maxc] - bc[g == maxc]
+        h[r == maxc] = bc[r == maxc] - gc[r == maxc]
+        h[deltac == 0] = 0.0
+        h = (h / 6.0) % 1.0
+        return np.stack((h, s, v), axis=-1)
+
+    hsv_mean = np.mean(rgb_to_hsv(image_np.astype(np.float32)), axis=(0, 1))
+    rgb_std = np.std(image_np, axis=(0, 1))
+
+    gray = np.dot(image_np[..., :3], [0.2989, 0.5870, 0.1140])
+    h, w = gray.shape
+    gx = np.zeros((h, w))
+    gy = np.zeros((h, w))
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    edge_density = np.mean(np.sqrt(gx ** 2 + gy ** 2)) / 255.0
+
+    window_size = 16
+    if h > 400 or w > 400:
+        scale = 400 / max(h, w)
+        gray = np.array(Image.fromarray(gray.astype(np.uint8)).resize((int(w * scale), int(h * scale))))
+    h, w = gray.shape
+    blocks_h, blocks_w = max(1, h // window_size), max(1, w // window_size)
+    local_std = np.zeros((blocks_h, blocks_w))
+    for i in range(blocks_h):
+        for j in range(blocks_w):
+            local_std[i, j] = np.std(gray[i * window_size:min((i + 1) * window_size, h),
+                                          j * window_size:min((j + 1) * window_size, w)])
+    return {
+        'brightness': float(hsv_mean[2]),
+        'saturation': float(hsv_mean[1]),
+        'contrast': float(np.mean(rgb_std) / 255.0),
+        'edge_density': float(edge_density),
+        'texture_contrast': float(np.std(local_std) / 255.0),
+        'texture_roughness': float(np.mean(local_std) / 255.0),
+    }
+
+
+def working_statistics(image_np, working_size):
+    work = image_features.working_image(image_np, working_size)
+    color = image_features.color_statistics(work)
+    return {
+        'brightness': color['brightness'],
+        'saturation': color['saturation'],
+        'contrast': float(np.mean(color['rgb_std']) / 255.0),
+        **image_features.texture_statistics(image_np, work),
+    }
+
+
+def measure(fn, *args):
+    """(result, seconds, peak MB allocated while fn ran)."""
+    tracemalloc.start()
+    result, seconds = timed(fn, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='directory of real test images instead of the synthetic corpus')
+    parser.add_argument('--sizes', nargs='+', default=['1920x1080', '4000x3000'],
+                        help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--working-sizes', type=int, nargs='+', default=[0, 1024])
+    parser.add_argument('--json', help='write the full report to this file')
+    args = parser.parse_args()
+
+    report = []
+    print(f"{'image':<22} {'method':<12} {'ms':>8} {'peak MB':>8} {'max diff':>9}  statistic")
+    for name, image in load_corpus(args.images, parse_sizes(args.sizes)):
+        image_np = np.asarray(image)
+        reference, seconds, peak = measure(reference_statistics, image_np)
+        print(f"{name:<22} {'original':<12} {seconds * 1000:>8.1f} {peak:>8.1f} {'':>9}")
+        rows = [{'method': 'original', 'ms': seconds * 1000, 'peak_mb': peak, 'statistics': reference}]
+        for working_size in args.working_sizes:
+            result, seconds, peak = measure(working_statistics, image_np, working_size)
+            worst = max(STATISTICS, key=lambda key: abs(result[key] - reference[key]))
+            diff = abs(result[worst] - reference[worst])
+            method = f"working {working_size or 'full'}"
+            print(f"{name:<22} {method:<12} {seconds * 1000:>8.1f} {peak:>8.1f} {diff:>9.4f}  {worst}")
+            rows.append({'method': method, 'ms': seconds * 1000, 'peak_mb': peak, 'max_diff': diff,
+                         'statistics': result})
+        report.append({'image': name, 'results': rows})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
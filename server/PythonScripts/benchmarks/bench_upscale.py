@@ -0,0 +1,217 @@
+"""Upscaler benchmark and regression check over a fixed synthetic corpus.
+
+    python PythonScripts/benchmarks/bench_upscale.py --engines eager torchscript --tile-sizes 128 256 \
+        --threads 1 4 --json results.json
+    python PythonScripts/benchmarks/bench_upscale.py --baseline results.json --max-latency-regression 0.1
+
+Every combination of engine, tile size and thread count runs in a fresh process, the way a worker
+starts, so the numbers include a real cold start. Per configuration the script reports the
+cold-start time (import, weight loading, warm-up), p50/p90/p99 per-image latency, images/sec,
+peak RSS, and the worst PSNR of its outputs against the first configuration's outputs.
+
+With --baseline, each configuration is compared to the one with the same engine, tile size and
+thread count in an earlier --json file, and the exit code is 1 when latency, cold start or peak
+RSS grew by more than the allowed fraction, or PSNR dropped below --min-psnr.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import SCRIPTS_DIR, parse_sizes, psnr, synthetic_corpus, to_tensor
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process. VmHWM starts over at exec, unlike ru_maxrss, which
+    would still include the parent that spawned us."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(config):
+    """Run one configuration in this process and print its measurements as JSON."""
+    import torch
+    torch.set_num_threads(config['threads'])
+
+    start = time.perf_counter()
+    import Upscale
+    Upscale.get_model('cpu', config['tier'], config['scale'])
+    cold_start = time.perf_counter() - start
+
+    latencies = []
+    for index, (name, image) in enumerate(synthetic_corpus(parse_sizes(config['sizes']))):
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        begin = time.perf_counter()
+        result = Upscale.upscale_image(buffer.getvalue(), {'tier': config['tier'], 'scale': config['scale'],
+                                                           'tile_size': config['tile_size']})
+        latencies.append(time.perf_counter() - begin)
+        with open(os.path.join(config['output_dir'], f"{index:03d}_{name}.png"), 'wb') as f:
+            f.write(result)
+
+    print(json.dumps({
+        'cold_start_seconds': cold_start,
+        'latencies': latencies,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def run_config(config):
+    env = {
+        **os.environ,
+        'PYTHONPATH': SCRIPTS_DIR,
+        'OMP_NUM_THREADS': str(config['threads']),
+        'UPSCALE_ENGINE': config['engine'],
+        'UPSCALE_ENGINE_DIR': config['engine_dir'],
+        # measure the model, not the result cache or admission control
+        'UPSCALE_CACHE_MAX_MB': '0',
+        'UPSCALE_MAX_LATENCY_MS': '0',
+        'UPSCALE_MAX_MEMORY_MB': '0',
+        'UPSCALE_DETAIL_THRESHOLD': '0',
+    }
+    proc = subprocess.run([sys.executable, __file__, '--child', json.dumps(config)], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"configuration {config['engine']}/{config['tile_size']}/{config['threads']} failed:\n"
+                           f"{proc.stderr[-2000:]}")
+    measurements = json.loads(proc.stdout.strip().splitlines()[-1])
+    latencies = np.array(measurements['latencies'])
+    return {
+        'engine': config['engine'],
+        'tile_size': config['tile_size'],
+        'threads': config['threads'],
+        'cold_start_seconds': measurements['cold_start_seconds'],
+        'latency_ms': {f"p{q}": float(np.percentile(latencies, q) * 1000) for q in (50, 90, 99)},
+        'images_per_second': len(latencies) / latencies.sum(),
+        'peak_rss_mb': measurements['peak_rss_mb'],
+    }
+
+
+def load_outputs(directory):
+    from PIL import Image
+    outputs = {}
+    for name in sorted(os.listdir(directory)):
+        with Image.open(os.path.join(directory, name)) as image:
+            outputs[name] = to_tensor(image.convert('RGB'))
+    return outputs
+
+
+def config_key(result):
+    return (result['engine'], result['tile_size'], result['threads'])
+
+
+def check_regressions(results, baseline, args):
+    """Reasons the results regress against a baseline report (empty when they do not)."""
+    previous = {config_key(result): result for result in baseline['results']}
+    failures = []
+    for result in results:
+        old = previous.get(config_key(result))
+        label = '{}/tile {}/{} threads'.format(*config_key(result))
+        if result['worst_psnr'] < args.min_psnr:
+            failures.append(f"{label}: worst PSNR {result['worst_psnr']:.2f} dB < {args.min_psnr} dB")
+        if old is None:
+            continue
+        checks = [
+            ('p50 latency', result['latency_ms']['p50'], old['latency_ms']['p50'], args.max_latency_regression),
+            ('cold start', result['cold_start_seconds'], old['cold_start_seconds'], args.max_cold_start_regression),
+            ('peak RSS', result['peak_rss_mb'], old['peak_rss_mb'], args.max_rss_regression),
+        ]
+        for metric, value, reference, allowed in checks:
+            if reference > 0 and value > reference * (1 + allowed):
+                failures.append(f"{label}: {metric} {value:.1f} vs {reference:.1f} "
+                                f"(+{value / reference - 1:.0%}, allowed +{allowed:.0%})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=['eager'])
+    parser.add_argument('--tile-sizes', type=int, nargs='+', default=[128, 256])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--tier', default='fast')
+    parser.add_argument('--scale', type=int, choices=[2, 4], default=4)
+    parser.add_argument('--sizes', nargs='+', default=['128x96', '256x192'],
+                        help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='earlier --json results to check for regressions')
+    parser.add_argument('--max-latency-regression', type=float, default=0.10)
+    parser.add_argument('--max-cold-start-regression', type=float, default=0.25)
+    parser.add_argument('--max-rss-regression', type=float, default=0.10)
+    parser.add_argument('--min-psnr', type=float, default=40.0,
+                        help='lowest acceptable PSNR against the first configuration')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(json.loads(args.child))
+        return
+
+    results = []
+    reference_outputs = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        engine_dir = os.path.join(work_dir, 'engines')
+        exported = [engine for engine in args.engines if engine != 'eager']
+        if exported:
+            import Upscale
+            from export_swinir import export_model
+            model = Upscale.load_swinir_model(args.tier, args.scale)
+            for engine in exported:
+                export_model(model, engine, args.tile_sizes, [1], engine_dir)
+
+        print(f"{'engine':<12} {'tile':>5} {'threads':>7} {'cold s':>7} {'p50 ms':>9} {'p90 ms':>9} "
+              f"{'p99 ms':>9} {'img/s':>6} {'RSS MB':>7} {'PSNR dB':>8}")
+        for engine, tile_size, threads in itertools.product(args.engines, args.tile_sizes, args.threads):
+            output_dir = os.path.join(work_dir, f"{engine}_{tile_size}_{threads}")
+            os.makedirs(output_dir)
+            result = run_config({
+                'engine': engine, 'tile_size': tile_size, 'threads': threads, 'tier': args.tier,
+                'scale': args.scale, 'sizes': args.sizes, 'engine_dir': engine_dir, 'output_dir': output_dir,
+            })
+            outputs = load_outputs(output_dir)
+            if reference_outputs is None:
+                reference_outputs = outputs
+            result['worst_psnr'] = min(psnr(reference_outputs[name], output) for name, output in outputs.items())
+            results.append(result)
+            latency = result['latency_ms']
+            print(f"{engine:<12} {tile_size:>5} {threads:>7} {result['cold_start_seconds']:>7.2f} "
+                  f"{latency['p50']:>9.0f} {latency['p90']:>9.0f} {latency['p99']:>9.0f} "
+                  f"{result['images_per_second']:>6.2f} {result['peak_rss_mb']:>7.0f} {result['worst_psnr']:>8.2f}")
+
+    report = {
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                        'cpu_count': os.cpu_count(), 'torch': __import__('torch').__version__},
+        'corpus': {'sizes': args.sizes, 'tier': args.tier, 'scale': args.scale},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {'results': []}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = check_regressions(results, baseline, args)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
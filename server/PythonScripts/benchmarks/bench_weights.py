@@ -0,0 +1,110 @@
+"""Measure upscale worker startup time and memory for each checkpoint loading mode.
+
+    python PythonScripts/benchmarks/bench_weights.py --workers 1 4 8 --modes copy torch-mmap safetensors
+
+For every mode and worker count, that many processes load the model at the same time (as
+UPSCALE_WORKERS would) and stay alive until all are loaded. Reported per configuration:
+mean/max load time, summed RSS, and summed PSS. PSS splits shared pages between the processes
+that map them, so it shows how much memory the node really spends; with mapped weights the
+total PSS should grow much more slowly than RSS as workers are added.
+Run convert_weights.py first for the safetensors mode.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import SCRIPTS_DIR
+
+
+def memory_kb():
+    """(rss_kb, pss_kb) of the current process from /proc (Linux only)."""
+    rss = pss = 0
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+    except FileNotFoundError:
+        pss = rss
+    return rss, pss
+
+
+def child(mode, tier, scale, barrier_path):
+    start = time.perf_counter()
+    import Upscale
+    model = Upscale.load_swinir_model(tier, scale, weights_loading=mode)
+    load_seconds = time.perf_counter() - start
+
+    # wait until every sibling has loaded, so PSS reflects all workers sharing pages
+    print(json.dumps({'ready': True}), flush=True)
+    while not os.path.exists(barrier_path):
+        time.sleep(0.05)
+    rss, pss = memory_kb()
+    print(json.dumps({'load_seconds': load_seconds, 'rss_kb': rss, 'pss_kb': pss}), flush=True)
+    del model
+
+
+def run(mode, workers, tier, scale, barrier_path):
+    if os.path.exists(barrier_path):
+        os.remove(barrier_path)
+    env = {**os.environ, 'OMP_NUM_THREADS': '1', 'PYTHONPATH': SCRIPTS_DIR}
+    procs = [subprocess.Popen([sys.executable, __file__, '--child', mode, '--tier', tier, '--scale', str(scale),
+                               '--barrier', barrier_path],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+             for _ in range(workers)]
+    for proc in procs:
+        proc.stdout.readline()
+    open(barrier_path, 'w').close()
+    results = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.wait()
+    os.remove(barrier_path)
+    return {
+        'mode': mode,
+        'workers': workers,
+        'mean_load_seconds': sum(r['load_seconds'] for r in results) / workers,
+        'max_load_seconds': max(r['load_seconds'] for r in results),
+        'total_rss_mb': sum(r['rss_kb'] for r in results) / 1024,
+        'total_pss_mb': sum(r['pss_kb'] for r in results) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--modes', nargs='+', default=['copy', 'torch-mmap', 'safetensors'])
+    parser.add_argument('--tier', default='quality')
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--barrier', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.tier, args.scale, args.barrier)
+        return
+
+    barrier_path = os.path.join('/tmp', f'bench_weights_{os.getpid()}.barrier')
+    rows = []
+    print(f"{'mode':<12} {'workers':>7} {'mean load s':>12} {'max load s':>11} {'RSS MB':>9} {'PSS MB':>9}")
+    for mode in args.modes:
+        for workers in args.workers:
+            row = run(mode, workers, args.tier, args.scale, barrier_path)
+            rows.append(row)
+            print(f"{mode:<12} {workers:>7} {row['mean_load_seconds']:>12.2f} {row['max_load_seconds']:>11.2f} "
+                  f"{row['total_rss_mb']:>9.0f} {row['total_pss_mb']:>9.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
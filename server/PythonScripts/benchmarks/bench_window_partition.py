@@ -0,0 +1,100 @@
+"""Check and time the fused shift + window partition gathers against torch.roll + window_partition.
+
+    python PythonScripts/benchmarks/bench_window_partition.py --tiles 64 128 256 --model fast
+
+For every tile size, a SwinIR-M sized block (dim 180, 6 heads, window 8) is run with and without
+shift, once with the index gathers (SwinIR default) and once with the original view/roll path.
+The outputs must be bit-exact. Reported: ms for shift + partition + reverse alone, and for the
+whole block. SwinIR only uses the gathers in shifted blocks; the shift 0 rows show why. With --model, the full upscaler of that tier is compared end to end as well.
+"""
+import argparse
+import sys
+
+import torch
+
+from common import time_ms
+
+from models.network_swinir import (  # noqa: E402  (path set up by common)
+    SwinTransformerBlock, WindowPartitionCache, window_partition, window_reverse)
+
+
+def view_round_trip(x, block, x_size):
+    B, L, C = x.shape
+    H, W = x_size
+    shift = block.shift_size
+    shifted = torch.roll(x.view(B, H, W, C), shifts=(-shift, -shift), dims=(1, 2)) if shift else x.view(B, H, W, C)
+    windows = window_partition(shifted, block.window_size).view(-1, block.window_size ** 2, C)
+    merged = window_reverse(windows.view(-1, block.window_size, block.window_size, C), block.window_size, H, W)
+    return torch.roll(merged, shifts=(shift, shift), dims=(1, 2)) if shift else merged
+
+
+def index_round_trip(x, block, x_size, cache):
+    B, L, C = x.shape
+    partition, reverse = cache.get(block, x_size, x.device)
+    windows = x.index_select(1, partition).view(-1, block.window_size ** 2, C)
+    return windows.view(B, L, C).index_select(1, reverse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiles', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--model', choices=['quality', 'fast'], help='also compare a full upscaler end to end')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    dim, heads, window = 180, 6, 8
+    failed = False
+
+    print(f"threads={args.threads} batch={args.batch}")
+    print(f"{'tile':>6} {'shift':>6} {'roll+view ms':>13} {'gather ms':>10} {'block view ms':>14} "
+          f"{'block gather ms':>16} {'bit-exact':>10}")
+    for tile in args.tiles:
+        for shift in (0, window // 2):
+            block = SwinTransformerBlock(dim, (64, 64), heads, window_size=window, shift_size=shift,
+                                         mlp_ratio=2).eval()
+            cache = WindowPartitionCache()
+            x_size = (tile, tile)
+            x = torch.randn(args.batch, tile * tile, dim)
+
+            with torch.no_grad():
+                exact = torch.equal(view_round_trip(x, block, x_size).reshape(x.shape),
+                                    index_round_trip(x, block, x_size, cache))
+                view_ms = time_ms(lambda: view_round_trip(x, block, x_size), args.repeats)
+                gather_ms = time_ms(lambda: index_round_trip(x, block, x_size, cache), args.repeats)
+
+                block.partition_cache = None
+                view_out = block(x, x_size)
+                block_view_ms = time_ms(lambda: block(x, x_size), args.repeats)
+                block.partition_cache = cache
+                gather_out = block(x, x_size)
+                block_gather_ms = time_ms(lambda: block(x, x_size), args.repeats)
+                exact = exact and torch.equal(view_out, gather_out)
+
+            failed = failed or not exact
+            print(f"{tile:>6} {shift:>6} {view_ms:>13.2f} {gather_ms:>10.2f} {block_view_ms:>14.2f} "
+                  f"{block_gather_ms:>16.2f} {str(exact):>10}")
+
+    if args.model:
+        import Upscale
+        model = Upscale.load_swinir_model(args.model, 4)
+        x = torch.rand(1, 3, 96, 80)
+        with torch.no_grad():
+            model.set_window_partition('view')
+            view_out = model(x)
+            view_ms = time_ms(lambda: model(x), max(1, args.repeats // 5))
+            model.set_window_partition('index')
+            index_out = model(x)
+            index_ms = time_ms(lambda: model(x), max(1, args.repeats // 5))
+        exact = torch.equal(view_out, index_out)
+        failed = failed or not exact
+        print(f"{args.model} x4 on 80x96: view {view_ms:.0f} ms, index {index_ms:.0f} ms, bit-exact {exact}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Throughput and latency of K upscale workers sharing the node's cores.
+
+    python PythonScripts/benchmarks/bench_workers.py --workers 1 2 4 --requests 16 --pin
+
+For every K, K real `Upscale.py --serve` workers are started with the environment the Node pool
+gives them (cores split evenly, UPSCALE_NUM_THREADS/OMP_NUM_THREADS, optional pinning), and the
+requests are fed to whichever worker is free, one at a time per worker. Reported: wall time,
+images/sec and p50/p90 request latency. --unbudgeted runs the same with every worker on torch's
+default thread count, which shows what oversubscription costs.
+"""
+import argparse
+import io
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from common import SCRIPTS_DIR, parse_sizes, synthetic_corpus
+
+from worker_protocol import FrameWriter, read_frame  # noqa: E402  (path set up by common)
+
+
+def worker_env(index, workers, cpu_count, pin, budgeted):
+    """The per-worker environment, as controllers/UpscaleImage.js builds it."""
+    env = {**os.environ, 'UPSCALE_MAX_INFLIGHT': '1', 'UPSCALE_CACHE_MAX_MB': '0',
+           'UPSCALE_MAX_LATENCY_MS': '0', 'UPSCALE_MAX_MEMORY_MB': '0'}
+    if not budgeted:
+        return env
+    threads = max(1, cpu_count // workers)
+    env.update({'UPSCALE_NUM_THREADS': str(threads), 'OMP_NUM_THREADS': str(threads),
+                'MKL_NUM_THREADS': str(threads)})
+    if pin:
+        cores = sorted({(index * threads + offset) % cpu_count for offset in range(threads)})
+        env['UPSCALE_CPU_AFFINITY'] = ','.join(str(core) for core in cores)
+    return env
+
+
+def run(workers, payloads, settings, cpu_count, pin, budgeted):
+    procs = [subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, 'Upscale.py'), '--serve'],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              env=worker_env(index, workers, cpu_count, pin, budgeted))
+             for index in range(workers)]
+    for proc in procs:
+        header, _ = read_frame(proc.stdout)
+        assert header['type'] == 'ready', header
+
+    jobs = queue.Queue()
+    for request_id, payload in enumerate(payloads):
+        jobs.put((request_id, payload))
+    latencies = []
+    lock = threading.Lock()
+
+    def client(proc):
+        writer = FrameWriter(proc.stdin)
+        while True:
+            try:
+                request_id, payload = jobs.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            writer.write({'id': request_id, 'settings': settings}, payload)
+            header, _ = read_frame(proc.stdout)
+            if header['type'] != 'result':
+                raise RuntimeError(header.get('error'))
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(proc,)) for proc in procs]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    for proc in procs:
+        proc.stdin.close()
+        proc.wait()
+    latencies = np.array(latencies)
+    return wall, len(payloads) / wall, np.percentile(latencies, 50), np.percentile(latencies, 90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--requests', type=int, default=8)
+    parser.add_argument('--sizes', nargs='+', default=['128x96'], help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--tier', default='fast')
+    parser.add_argument('--tile-size', type=int, default=128)
+    parser.add_argument('--pin', action='store_true', help='pin every worker to its own cores')
+    parser.add_argument('--unbudgeted', action='store_true', help='also run without thread budgets')
+    args = parser.parse_args()
+
+    cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    images = []
+    for _, image in synthetic_corpus(parse_sizes(args.sizes)):
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        images.append(buffer.getvalue())
+    payloads = [images[i % len(images)] for i in range(args.requests)]
+    settings = {'tier': args.tier, 'tile_size': args.tile_size}
+
+    print(f"cores={cpu_count} requests={args.requests} pin={args.pin}")
+    print(f"{'workers':>7} {'threads/worker':>15} {'wall s':>8} {'img/s':>7} {'p50 s':>7} {'p90 s':>7}")
+    modes = [True, False] if args.unbudgeted else [True]
+    for budgeted in modes:
+        for workers in args.workers:
+            wall, throughput, p50, p90 = run(workers, payloads, settings, cpu_count, args.pin, budgeted)
+            threads = str(max(1, cpu_count // workers)) if budgeted else 'default'
+            print(f"{workers:>7} {threads:>15} {wall:>8.1f} {throughput:>7.2f} {p50:>7.2f} {p90:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
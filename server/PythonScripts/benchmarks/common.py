@@ -0,0 +1,134 @@
+"""Shared helpers for the benchmarks: a deterministic image corpus, quality metrics and timing."""
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image, ImageDraw
+
+# Make the PythonScripts modules (Upscale, models.network_swinir, ...) importable from here
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+
+def _gradient(width, height, rng):
+    x = np.linspace(0, 1, width)[None, :, None]
+    y = np.linspace(0, 1, height)[:, None, None]
+    colors = rng.uniform(0, 1, (3, 3))
+    img = colors[0] * x + colors[1] * y + colors[2] * (1 - x) * (1 - y)
+    return Image.fromarray((np.clip(img, 0, 1) * 255).astype(np.uint8))
+
+
+def _shapes(width, height, rng):
+    img = Image.new('RGB', (width, height), tuple(int(c) for c in rng.integers(0, 255, 3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(max(4, width * height // 4000)):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1, y1 = x0 + int(rng.integers(4, width // 3 + 5)), y0 + int(rng.integers(4, height // 3 + 5))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        if rng.random() < 0.5:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+        else:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+    return img
+
+
+def _texture(width, height, rng):
+    # band-limited noise, similar to foliage/fabric detail
+    noise = rng.normal(0.5, 0.2, (height // 4 + 1, width // 4 + 1, 3))
+    small = Image.fromarray((np.clip(noise, 0, 1) * 255).astype(np.uint8))
+    return small.resize((width, height), Image.BICUBIC)
+
+
+def _lines(width, height, rng):
+    # thin high-contrast strokes, the hardest case for seams and quantization error
+    img = Image.new('RGB', (width, height), (245, 245, 240))
+    draw = ImageDraw.Draw(img)
+    for _ in range(max(8, (width + height) // 10)):
+        points = [(int(rng.integers(0, width)), int(rng.integers(0, height))) for _ in range(2)]
+        draw.line(points, fill=tuple(int(c) for c in rng.integers(0, 120, 3)), width=int(rng.integers(1, 3)))
+    return img
+
+
+PATTERNS = {
+    'gradient': _gradient,
+    'shapes': _shapes,
+    'texture': _texture,
+    'lines': _lines,
+}
+
+
+def synthetic_corpus(sizes=((64, 64), (128, 96), (256, 256)), patterns=None, seed=0):
+    """Yield (name, PIL image) pairs. The same arguments always produce the same pixels."""
+    for width, height in sizes:
+        for name in patterns or PATTERNS:
+            rng = np.random.default_rng([seed, width, height, list(PATTERNS).index(name)])
+            yield f"{name}_{width}x{height}", PATTERNS[name](width, height, rng)
+
+
+def load_corpus(image_dir=None, sizes=((64, 64), (128, 96), (256, 256)), seed=0):
+    """Images from image_dir when given (e.g. real uploads), otherwise the synthetic corpus."""
+    if not image_dir:
+        return list(synthetic_corpus(sizes, seed=seed))
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        try:
+            images.append((name, Image.open(os.path.join(image_dir, name)).convert('RGB')))
+        except OSError:
+            continue
+    return images
+
+
+def parse_sizes(values):
+    """['64x64', '128x96'] -> [(64, 64), (128, 96)]"""
+    return [tuple(int(v) for v in value.lower().split('x')) for value in values]
+
+
+def to_tensor(image):
+    return torch.from_numpy(np.asarray(image, dtype=np.float32) / 255.0).permute(2, 0, 1).unsqueeze(0)
+
+
+def psnr(reference, output):
+    """PSNR in dB between two (1, C, H, W) tensors in [0, 1]."""
+    mse = F.mse_loss(output.clamp(0, 1), reference.clamp(0, 1)).item()
+    return float('inf') if mse == 0 else 10 * np.log10(1.0 / mse)
+
+
+def ssim(reference, output, window_size=11, sigma=1.5):
+    """Mean SSIM between two (1, C, H, W) tensors in [0, 1], gaussian window as in Wang et al. 2004."""
+    channels = reference.shape[1]
+    coords = torch.arange(window_size, dtype=torch.float32) - window_size // 2
+    kernel_1d = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    kernel_1d /= kernel_1d.sum()
+    kernel = (kernel_1d[:, None] * kernel_1d[None, :]).expand(channels, 1, window_size, window_size)
+
+    def blur(x):
+        return F.conv2d(x, kernel, groups=channels)
+
+    x, y = reference.clamp(0, 1).float(), output.clamp(0, 1).float()
+    mu_x, mu_y = blur(x), blur(y)
+    sigma_x = blur(x * x) - mu_x ** 2
+    sigma_y = blur(y * y) - mu_y ** 2
+    sigma_xy = blur(x * y) - mu_x * mu_y
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / \
+               ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+    return ssim_map.mean().item()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def time_ms(fn, repeats):
+    """Mean milliseconds per fn() call over repeats calls, after one untimed warm-up call."""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
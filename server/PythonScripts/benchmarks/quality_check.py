@@ -0,0 +1,80 @@
+"""Check that reduced-precision upscaling keeps quality before enabling UPSCALE_PRECISION.
+
+    python PythonScripts/benchmarks/quality_check.py --precisions int8 bf16 --min-psnr 38 --min-ssim 0.98
+
+Every image of the corpus (synthetic by default, or --images DIR) is upscaled with the fp32
+model and with each candidate precision. PSNR/SSIM of the candidate against the fp32 output
+and the speedup are reported, and the exit code is 1 when any image falls below the limits.
+"""
+import argparse
+import json
+import sys
+
+import torch
+
+from common import load_corpus, parse_sizes, psnr, ssim, timed, to_tensor
+
+import Upscale  # noqa: E402  (path set up by common)
+
+
+def upscale_all(model, corpus, tile_size):
+    outputs, seconds = [], 0.0
+    with torch.no_grad():
+        for _, image in corpus:
+            tensor = to_tensor(image)
+            output, elapsed = timed(Upscale.tiled_forward, model, tensor, tile_size, Upscale.DEFAULT_TILE_OVERLAP)
+            outputs.append(output)
+            seconds += elapsed
+    return outputs, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precisions', nargs='+', default=['int8', 'bf16'])
+    parser.add_argument('--images', help='directory of real test images instead of the synthetic corpus')
+    parser.add_argument('--sizes', nargs='+', default=['64x64', '128x96', '256x256'],
+                        help='synthetic corpus sizes as WIDTHxHEIGHT')
+    parser.add_argument('--tile-size', type=int, default=Upscale.DEFAULT_TILE_SIZE or Upscale.MAX_TILE_SIZE)
+    parser.add_argument('--min-psnr', type=float, default=38.0)
+    parser.add_argument('--min-ssim', type=float, default=0.98)
+    parser.add_argument('--json', help='write the full report to this file')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images, parse_sizes(args.sizes))
+    reference_model = Upscale.load_swinir_model()
+    # one untimed pass so allocator and kernel warmup does not count against fp32
+    upscale_all(reference_model, corpus[:1], args.tile_size)
+    references, reference_seconds = upscale_all(reference_model, corpus, args.tile_size)
+    print(f"fp32: {reference_seconds:.2f}s for {len(corpus)} images")
+
+    report = {'fp32_seconds': reference_seconds, 'precisions': {}}
+    failed = False
+    for precision in args.precisions:
+        model = Upscale.apply_precision(Upscale.load_swinir_model(), precision)
+        upscale_all(model, corpus[:1], args.tile_size)
+        outputs, seconds = upscale_all(model, corpus, args.tile_size)
+
+        rows = []
+        for (name, _), reference, output in zip(corpus, references, outputs):
+            rows.append({'image': name, 'psnr': psnr(reference, output), 'ssim': ssim(reference, output)})
+        worst_psnr = min(row['psnr'] for row in rows)
+        worst_ssim = min(row['ssim'] for row in rows)
+        passed = worst_psnr >= args.min_psnr and worst_ssim >= args.min_ssim
+        failed = failed or not passed
+
+        print(f"{precision}: {seconds:.2f}s, speedup {reference_seconds / seconds:.2f}x, "
+              f"worst PSNR {worst_psnr:.2f} dB, worst SSIM {worst_ssim:.4f} -> {'PASS' if passed else 'FAIL'}")
+        for row in rows:
+            print(f"    {row['image']:<24} PSNR {row['psnr']:7.2f} dB  SSIM {row['ssim']:.4f}")
+        report['precisions'][precision] = {
+            'seconds': seconds, 'speedup': reference_seconds / seconds, 'passed': passed, 'images': rows
+        }
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import os
+import sys
+
+import numpy as np
+
+# Converted classifiers built by convert_classifier.py
+CLASSIFIER_DIR = os.environ.get('ANALYSIS_CLASSIFIER_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'engines')
+BACKEND_EXTENSIONS = {'tflite': '.tflite', 'onnx': '.onnx'}
+
+
+def artifact_name(model_name, precision, backend):
+    return f"classifier_{model_name}_{precision}{BACKEND_EXTENSIONS[backend]}"
+
+
+def preprocess_mode(model_name):
+    """EfficientNet rescales inside the model and takes raw pixels; MobileNetV2 expects [-1, 1]."""
+    return 'none' if 'efficient' in model_name.lower() else 'tf'
+
+
+class KerasClassifier:
+    """EfficientNetB2 (MobileNetV2 if it cannot be built) on the full TensorFlow runtime."""
+
+    backend = 'keras'
+
+    def __init__(self):
+        import tensorflow as tf
+        tf.get_logger().setLevel('ERROR')
+        try:
+            self.model = tf.keras.applications.EfficientNetB2(include_top=True, weights='imagenet')
+        except Exception:
+            self.model = tf.keras.applications.MobileNetV2(include_top=True, weights='imagenet')
+        self.name = self.model.name
+        self.input_shape = self.model.input_shape
+
+    def __call__(self, batch):
+        return self.model(batch, training=False).numpy()
+
+
+def _tflite_interpreter():
+    # The standalone runtimes are a few MB; TensorFlow's own interpreter is the last resort
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteClassifier:
+    """A converted .tflite classifier. Quantized inputs/outputs are (de)quantized here."""
+
+    backend = 'tflite'
+
+    def __init__(self, path, model_name):
+        self.interpreter = _tflite_interpreter()(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.name = model_name
+        self.input_shape = tuple(int(d) for d in self.input['shape'])
+
+    def __call__(self, batch):
+        # The model is converted for batch size 1; resizing it per batch would reallocate every time
+        scale, zero_point = self.input['quantization']
+        outputs = []
+        for image in batch:
+            x = image[None]
+            if scale:
+                info = np.iinfo(self.input['dtype'])
+                x = np.clip(np.round(x / scale + zero_point), info.min, info.max)
+            self.interpreter.set_tensor(self.input['index'], x.astype(self.input['dtype']))
+            self.interpreter.invoke()
+            outputs.append(self._dequantize(self.interpreter.get_tensor(self.output['index'])[0]))
+        return np.stack(outputs)
+
+    def _dequantize(self, y):
+        scale, zero_point = self.output['quantization']
+        return (y.astype(np.float32) - zero_point) * scale if scale else y
+
+
+class OnnxClassifier:
+    """A converted .onnx classifier (NHWC input, dynamic batch) on ONNX Runtime's CPU provider."""
+
+    backend = 'onnx'
+
+    def __init__(self, path, model_name):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.name = model_name
+        self.input_shape = tuple(d if isinstance(d, int) else None for d in model_input.shape)
+
+    def __call__(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+def load_classifier(backend='keras', model_name='efficientnetb2', precision='int8', directory=CLASSIFIER_DIR):
+    """The classifier for a backend. A missing artifact or runtime falls back to Keras.
+
+    Every classifier has a name, an NHWC input_shape, and maps a float32 (N, H, W, 3) batch,
+    preprocessed per preprocess_mode(name), to (N, 1000) class probabilities.
+    """
+    if backend != 'keras':
+        if backend not in BACKEND_EXTENSIONS:
+            raise ValueError(f"Unknown classifier backend: {backend}")
+        path = os.path.join(directory, artifact_name(model_name, precision, backend))
+        try:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found, run convert_classifier.py")
+            runner = TFLiteClassifier if backend == 'tflite' else OnnxClassifier
+            return runner(path, model_name)
+        except (ImportError, FileNotFoundError) as e:
+            print(f"{backend} classifier is not available ({e}), using Keras", file=sys.stderr)
+    return KerasClassifier()
@@ -0,0 +1,111 @@
+"""Convert the analyzer's Keras classifier to quantized TFLite / ONNX models for light CPU runtimes.
+
+    python PythonScripts/convert_classifier.py --format tflite onnx --precision int8 --images uploads/
+
+Models are written to PythonScripts/engines/ (or ANALYSIS_CLASSIFIER_DIR) as
+classifier_{model}_{precision}.tflite / .onnx; image_analysis.py runs them with
+ANALYSIS_BACKEND=tflite|onnx, which no longer imports TensorFlow. int8 quantization is calibrated
+on --images (a few hundred typical uploads give the best scales) or, without it, the synthetic
+benchmark corpus. Check the result with benchmarks/bench_classifier.py before switching.
+
+Converting needs TensorFlow, plus tf2onnx and onnxruntime for ONNX.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from classifier_backends import BACKEND_EXTENSIONS, CLASSIFIER_DIR, KerasClassifier, artifact_name, preprocess_mode
+
+
+def calibration_images(image_dir, count, input_size, model_name):
+    """Up to count preprocessed (H, W, 3) float32 classifier inputs."""
+    if image_dir:
+        images = []
+        for name in sorted(os.listdir(image_dir)):
+            try:
+                images.append(Image.open(os.path.join(image_dir, name)).convert('RGB'))
+            except OSError:
+                continue
+    else:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+        from common import synthetic_corpus
+        images = [image for _, image in synthetic_corpus([(320, 320), (480, 360), (640, 480)])]
+    arrays = []
+    for image in images[:count]:
+        array = np.asarray(image.resize((input_size[1], input_size[0])), dtype=np.float32)
+        arrays.append(array / 127.5 - 1.0 if preprocess_mode(model_name) == 'tf' else array)
+    return arrays
+
+
+def convert_tflite(model, path, precision, calibration):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if precision == 'int8':
+        # int8 weights and activations; the input and output stay float32 for the caller
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x[None]] for x in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(model, path, precision, calibration):
+    import tensorflow as tf
+    import tf2onnx
+
+    height, width = model.input_shape[1:3]
+    float_path = path if precision == 'fp32' else path + '.fp32'
+    tf2onnx.convert.from_keras(model, input_signature=(tf.TensorSpec((None, height, width, 3), tf.float32,
+                                                                     name='input'),),
+                               opset=17, output_path=float_path)
+    if precision == 'fp32':
+        return
+
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # shape inference and graph folding first, so the quantizer sees the fused convolutions
+    prepared_path = float_path + '.prepared'
+    quant_pre_process(float_path, prepared_path)
+    input_name = onnx.load(prepared_path).graph.input[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.items = iter(calibration)
+
+        def get_next(self):
+            x = next(self.items, None)
+            return None if x is None else {input_name: x[None]}
+
+    # QDQ with per-channel int8 weights keeps EfficientNet's depthwise convolutions accurate
+    quantize_static(prepared_path, path, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    os.remove(float_path)
+    os.remove(prepared_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', nargs='+', choices=sorted(BACKEND_EXTENSIONS), default=['tflite'])
+    parser.add_argument('--precision', choices=['int8', 'fp32'], default='int8')
+    parser.add_argument('--images', help='directory of calibration images (default: synthetic corpus)')
+    parser.add_argument('--calibration-count', type=int, default=200)
+    parser.add_argument('--output-dir', default=CLASSIFIER_DIR)
+    args = parser.parse_args()
+
+    keras_classifier = KerasClassifier()
+    calibration = calibration_images(args.images, args.calibration_count, keras_classifier.input_shape[1:3],
+                                     keras_classifier.name)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for fmt in args.format:
+        path = os.path.join(args.output_dir, artifact_name(keras_classifier.name, args.precision, fmt))
+        if fmt == 'tflite':
+            convert_tflite(keras_classifier.model, path, args.precision, calibration)
+        else:
+            convert_onnx(keras_classifier.model, path, args.precision, calibration)
+        print(f"converted {path}", file=sys.stderr)
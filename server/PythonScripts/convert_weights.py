@@ -0,0 +1,49 @@
+"""Convert SwinIR .pth checkpoints to .safetensors for memory-mapped, zero-copy loading.
+
+    python PythonScripts/convert_weights.py                 # every checkpoint in Upscale.MODEL_TIERS
+    python PythonScripts/convert_weights.py path/to/model.pth
+
+The .safetensors file is written next to the .pth with the same base name; Upscale.py picks it
+up automatically. Only the 'params' state dict is kept. The .pth's size and modification time are
+stored in the file's metadata, and Upscale.py ignores the conversion once the .pth changes, so
+rerun this after replacing a checkpoint. Neither file belongs in git.
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+
+def convert(pth_path):
+    from safetensors.torch import save_file
+
+    from Upscale import checkpoint_identity
+
+    checkpoint = torch.load(pth_path, map_location='cpu')
+    state_dict = checkpoint.get('params', checkpoint)
+    # safetensors needs contiguous tensors that do not share storage
+    state_dict = {name: tensor.contiguous().clone() for name, tensor in state_dict.items()}
+    output_path = os.path.splitext(pth_path)[0] + '.safetensors'
+    tmp_path = output_path + '.tmp'
+    save_file(state_dict, tmp_path, metadata=checkpoint_identity(pth_path))
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoints', nargs='*', help='.pth files (default: all known upscaler checkpoints)')
+    args = parser.parse_args()
+
+    paths = args.checkpoints
+    if not paths:
+        import Upscale
+        paths = [Upscale._checkpoint_path(tier, scale)
+                 for tier, scales in Upscale.MODEL_TIERS.items() for scale in scales]
+
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"skipping {path}: not found", file=sys.stderr)
+            continue
+        print(f"{path} -> {convert(path)}")
@@ -0,0 +1,103 @@
+import time
+
+import torch
+
+FLOAT_BYTES = 4
+
+
+class OverBudgetError(RuntimeError):
+    """A request whose predicted cost exceeds the worker's budgets."""
+
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+def calibrate_throughput(model, run, size=64, device='cpu'):
+    """Measure the model's multiply-accumulates per second on this machine.
+
+    The first pass warms up allocator and kernels and is not timed. The result is stored on the
+    model as flops_per_second, which every later estimate for that model uses.
+    """
+    x = torch.zeros(1, 3, size, size, device=device)
+    with torch.no_grad():
+        run(model, x)
+        start = time.perf_counter()
+        run(model, x)
+        seconds = time.perf_counter() - start
+    model.flops_per_second = model.flops((size, size)) / max(seconds, 1e-6)
+    return model.flops_per_second
+
+
+def tile_shapes(height, width, tile_size, tile_overlap, tile_starts):
+    """Input shapes of every model call tiled_forward makes for an image."""
+    if not tile_size or (height <= tile_size and width <= tile_size):
+        return [(height, width)]
+    rows = [min(tile_size, height - y) for y in tile_starts(height, tile_size, tile_overlap)]
+    cols = [min(tile_size, width - x) for x in tile_starts(width, tile_size, tile_overlap)]
+    return [(h, w) for h in rows for w in cols]
+
+
+def _padded(size, window_size):
+    return size + (window_size - size % window_size) % window_size
+
+
+def activation_bytes(model, x_size):
+    """Rough peak activation memory of one forward pass on an (H, W) input.
+
+    Counts the token features alive inside a Swin block (input, shortcut, qkv, MLP hidden),
+    the window attention scores per head (raw, biased/masked and softmaxed copies), and the
+    largest feature map of the reconstruction. Errs on the high side for the budget check.
+    """
+    H, W = _padded(x_size[0], model.window_size), _padded(x_size[1], model.window_size)
+    tokens = H * W
+    embed_dim = model.embed_dim
+    block_features = tokens * embed_dim * (2 + 3 + model.mlp_ratio)
+    num_heads = max(layer.residual_group.blocks[0].num_heads for layer in model.layers)
+    attention = tokens * model.window_size ** 2 * num_heads * 3
+    if model.upsampler in ('pixelshuffle', 'nearest+conv'):
+        num_feat = model.conv_before_upsample[0].out_channels
+        reconstruction = tokens * model.upscale ** 2 * num_feat * 2
+    else:
+        reconstruction = tokens * model.upscale ** 2 * 3 * 2
+    return int((block_features + attention + reconstruction) * FLOAT_BYTES)
+
+
+def estimate_cost(model, height, width, tile_size, tile_overlap, tile_starts, tiles_in_flight=1, streaming=False):
+    """Predicted latency (ms) and request memory (bytes) of upscaling an image with this model.
+
+    streaming: output rows are encoded as they finish, so tiled_forward only holds one band of
+    tile rows instead of the whole output.
+    """
+    shapes = tile_shapes(height, width, tile_size, tile_overlap, tile_starts)
+    flops = sum(model.flops(shape) for shape in shapes)
+    flops_per_second = getattr(model, 'flops_per_second', None)
+    latency_ms = flops / flops_per_second * 1000 if flops_per_second else None
+
+    scale = model.upscale
+    tiled = len(shapes) > 1
+    held_pixels = height * scale * width * scale
+    if tiled and streaming:
+        held_pixels = min(tile_size, height) * scale * width * scale
+    # tiled_forward keeps an RGB accumulator and a weight plane; a single pass returns the output.
+    # The encoder's uint8 copy of the same rows comes on top.
+    buffers = held_pixels * (4 if tiled else 3) * FLOAT_BYTES + held_pixels * 3
+    peak_tile = max(activation_bytes(model, shape) for shape in shapes)
+    memory_bytes = buffers + peak_tile * min(tiles_in_flight, len(shapes))
+    return {
+        'tiles': len(shapes),
+        'flops': flops,
+        'latency_ms': latency_ms,
+        'memory_bytes': memory_bytes,
+    }
+
+
+def over_budget(estimate, max_latency_ms, max_memory_bytes):
+    """Human-readable reasons an estimate breaks the budgets (empty when it fits; 0 means unlimited)."""
+    reasons = []
+    if max_latency_ms and estimate['latency_ms'] is not None and estimate['latency_ms'] > max_latency_ms:
+        reasons.append(f"predicted time {estimate['latency_ms'] / 1000:.0f}s exceeds {max_latency_ms / 1000:.0f}s")
+    if max_memory_bytes and estimate['memory_bytes'] > max_memory_bytes:
+        reasons.append(f"predicted memory {estimate['memory_bytes'] / 2 ** 20:.0f} MB "
+                       f"exceeds {max_memory_bytes / 2 ** 20:.0f} MB")
+    return reasons
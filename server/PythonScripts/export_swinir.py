@@ -0,0 +1,149 @@
+"""Export the configured SwinIR to fixed-shape TorchScript / ONNX artifacts and run them.
+
+    python PythonScripts/export_swinir.py --format torchscript onnx --tier quality --scale 4 \
+        --tile-sizes 256 --batch-sizes 1 4
+
+Artifacts are written to PythonScripts/engines/ (or UPSCALE_ENGINE_DIR) as
+swinir_{tier}_x{scale}_{H}x{W}_b{batch}.pt / .onnx. Each artifact only accepts exactly that input
+shape; Upscale.py (UPSCALE_ENGINE=torchscript|onnx) uses them for matching tiles and falls
+back to the eager model for everything else. Artifacts are always fp32, so Upscale.py refuses to
+combine them with UPSCALE_PRECISION=int8|bf16.
+"""
+import argparse
+import inspect
+import os
+import re
+import sys
+
+import torch
+
+ENGINE_DIR = os.environ.get('UPSCALE_ENGINE_DIR', os.path.join(os.path.dirname(__file__), 'engines'))
+ENGINE_EXTENSIONS = {'torchscript': '.pt', 'onnx': '.onnx'}
+ARTIFACT_PATTERN = re.compile(r'^swinir_(\w+?)_x(\d+)_(\d+)x(\d+)_b(\d+)\.(pt|onnx)$')
+
+
+def artifact_name(tier, scale, height, width, batch, engine):
+    return f"swinir_{tier}_x{scale}_{height}x{width}_b{batch}{ENGINE_EXTENSIONS[engine]}"
+
+
+def export_torchscript(model, example, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_trace=False)
+        traced = torch.jit.freeze(traced.eval())
+    traced.save(path)
+
+
+def export_onnx(model, example, path):
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the tracing exporter handles SwinIR's Python-side shape logic for fixed shapes
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(model, example, path, input_names=['input'], output_names=['output'],
+                          opset_version=17, **kwargs)
+
+
+def export_model(model, engine, tile_sizes, batch_sizes, output_dir=ENGINE_DIR):
+    """Write one artifact per (tile size, batch size) and return their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    model.set_attention_backend('eager')
+    paths = []
+    for tile in tile_sizes:
+        height, width = tile if isinstance(tile, tuple) else (tile, tile)
+        # masks for this size become constants inside the artifact
+        model.precompute_attn_masks([(height, width)])
+        for batch in batch_sizes:
+            example = torch.rand(batch, 3, height, width)
+            name = artifact_name(getattr(model, 'tier', 'quality'), model.upscale, height, width, batch, engine)
+            path = os.path.join(output_dir, name)
+            if engine == 'torchscript':
+                export_torchscript(model, example, path)
+            else:
+                export_onnx(model, example, path)
+            paths.append(path)
+            print(f"exported {path}", file=sys.stderr)
+    return paths
+
+
+class ExportedEngine:
+    """Runs fixed-shape artifacts for the shapes they were exported for, eager SwinIR otherwise.
+
+    Attribute access falls through to the eager model, so the engine can be used anywhere
+    Upscale.py expects the model (upscale, window_size, precompute_attn_masks, ...).
+    """
+
+    def __init__(self, model, engine, artifact_dir=ENGINE_DIR):
+        self.model = model
+        self.engine = engine
+        self.runners = {}
+        self.calls = {'artifact': 0, 'eager': 0}
+        if os.path.isdir(artifact_dir):
+            for name in sorted(os.listdir(artifact_dir)):
+                match = ARTIFACT_PATTERN.match(name)
+                if not match or ENGINE_EXTENSIONS[engine] != '.' + match.group(6):
+                    continue
+                tier = match.group(1)
+                scale, height, width, batch = (int(v) for v in match.groups()[1:5])
+                if tier == getattr(model, 'tier', 'quality') and scale == model.upscale:
+                    self.runners[(batch, height, width)] = self._load(os.path.join(artifact_dir, name))
+        if not self.runners:
+            print(f"No {engine} artifacts in {artifact_dir}, using eager SwinIR", file=sys.stderr)
+
+    def _load(self, path):
+        if self.engine == 'torchscript':
+            return torch.jit.load(path, map_location='cpu')
+
+        import onnxruntime as ort
+        session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+        def run(x):
+            output = session.run(None, {'input': x.detach().cpu().numpy()})[0]
+            return torch.from_numpy(output)
+        return run
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, x):
+        batch, _, height, width = x.shape
+        runner = self.runners.get((batch, height, width))
+        if runner is not None:
+            self.calls['artifact'] += 1
+            return runner(x)
+        # a batch without its own artifact can still use the single-image one
+        single = self.runners.get((1, height, width))
+        if single is not None and batch > 1:
+            self.calls['artifact'] += batch
+            return torch.cat([single(x[i:i + 1]) for i in range(batch)], dim=0)
+        self.calls['eager'] += 1
+        return self.model(x)
+
+
+def load_engine(model, engine):
+    """Wrap an eager model in the requested engine; 'eager' or a missing runtime returns the model itself."""
+    if engine == 'eager':
+        return model
+    if engine not in ENGINE_EXTENSIONS:
+        raise ValueError(f"Unknown engine: {engine}")
+    try:
+        return ExportedEngine(model, engine)
+    except ImportError as e:
+        print(f"{engine} runtime is not available ({e}), using eager SwinIR", file=sys.stderr)
+        return model
+
+
+if __name__ == '__main__':
+    import Upscale
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', nargs='+', choices=sorted(ENGINE_EXTENSIONS), default=['torchscript'])
+    parser.add_argument('--tier', choices=sorted(Upscale.MODEL_TIERS), default='quality')
+    parser.add_argument('--scale', type=int, choices=[2, 4], default=4)
+    parser.add_argument('--tile-sizes', type=int, nargs='+', default=[Upscale.DEFAULT_TILE_SIZE or 256])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, Upscale.BATCH_SIZE])
+    parser.add_argument('--output-dir', default=ENGINE_DIR)
+    args = parser.parse_args()
+
+    swinir = Upscale.load_swinir_model(args.tier, args.scale)
+    for fmt in args.format:
+        export_model(swinir, fmt, args.tile_sizes, sorted(set(args.batch_sizes)), args.output_dir)
@@ -1,105 +1,128 @@
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-import tensorflow as tf
-tf.get_logger().setLevel('ERROR')
 import numpy as np
-from PIL import Image
-import io
 import json
 import sys
 import math
+from concurrent.futures import Future, ThreadPoolExecutor
+import image_features
+from classifier_backends import load_classifier, preprocess_mode
+
+# Requests a resident analyzer (--serve) works on at once. Color and texture extraction run
+# concurrently; classifier inputs are batched across requests (ANALYSIS_BATCH_SIZE at most, waiting
+# up to ANALYSIS_BATCH_WAIT_MS for a batch to fill).
+MAX_INFLIGHT_REQUESTS = int(os.environ.get('ANALYSIS_MAX_INFLIGHT', 4))
+BATCH_SIZE = int(os.environ.get('ANALYSIS_BATCH_SIZE', 4))
+BATCH_WAIT_MS = float(os.environ.get('ANALYSIS_BATCH_WAIT_MS', 10))
+# Count every n-th pixel of every n-th row for the dominant colors (1 counts them all)
+COLOR_SAMPLE_STRIDE = max(1, int(os.environ.get('ANALYSIS_COLOR_SAMPLE_STRIDE', 1)))
+# Long side of the float32 image the color and texture statistics are computed on (0 = full size).
+# Uploads are decoded at the smallest size that still covers it and the classifier input.
+WORKING_SIZE = int(os.environ.get('ANALYSIS_WORKING_SIZE', 1024))
+# 'auto' runs the classifier only when the color/texture mood is ambiguous (its best score is
+# below DECISIVE_MOOD_SCORE) or the caller asks for labels; 'always' runs it for every image
+CNN_MODE = os.environ.get('ANALYSIS_CNN', 'auto').lower()
+DECISIVE_MOOD_SCORE = 0.4
+# Classifier backend: 'keras' (TensorFlow, imported only then), or a 'tflite'/'onnx' model built by
+# convert_classifier.py for ANALYSIS_CLASSIFIER_MODEL at ANALYSIS_CLASSIFIER_PRECISION
+BACKEND = os.environ.get('ANALYSIS_BACKEND', 'keras').lower()
+CLASSIFIER_MODEL = os.environ.get('ANALYSIS_CLASSIFIER_MODEL', 'efficientnetb2')
+CLASSIFIER_PRECISION = os.environ.get('ANALYSIS_CLASSIFIER_PRECISION', 'int8')
+
+# Keras' imagenet_class_index.json, bundled so decoding never downloads it on first use
+CLASS_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imagenet_class_index.json')
+
+def decode_top_k(predictions, synsets, names, top=5):
+    """(synset, label, score) tuples of the top classes of every row of a batch, best first."""
+    predictions = np.asarray(predictions)
+    top = min(top, predictions.shape[1])
+    # argpartition finds the top columns without sorting all 1000 of them; only those are sorted
+    indices = np.argpartition(-predictions, top - 1, axis=1)[:, :top]
+    scores = np.take_along_axis(predictions, indices, axis=1)
+    order = np.argsort(-scores, axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    return [list(zip(synsets[row].tolist(), names[row].tolist(), row_scores.tolist()))
+            for row, row_scores in zip(indices, scores)]
 
 class EnhancedImageAnalyzer:
     def __init__(self):
-        try:
-            self.model = tf.keras.applications.EfficientNetB2(
-                include_top=True,
-                weights='imagenet'
-            )
-        except:
-            self.model = tf.keras.applications.MobileNetV2(
-                include_top=True,
-                weights='imagenet'
-            )
-        self.labels = self.load_imagenet_labels()
+        self.model = load_classifier(BACKEND, CLASSIFIER_MODEL, CLASSIFIER_PRECISION)
+        self.label_synsets, self.label_names = self.load_imagenet_labels()
+        self.batcher = None
         
     def load_imagenet_labels(self):
+        """Synset ids and labels of the 1000 ImageNet classes, as arrays indexed by class."""
+        with open(CLASS_INDEX_PATH, 'r') as f:
+            class_index = json.load(f)
+        entries = [class_index[str(i)] for i in range(len(class_index))]
+        return np.array([synset for synset, _ in entries]), np.array([label for _, label in entries])
+
+    def warmup(self):
+        """Run one prediction so the first real request does not pay for building the model's kernels."""
+        input_height, input_width = self.model.input_shape[1:3]
+        self.classify([np.zeros((input_height, input_width, 3), dtype=np.float32)])
+
+    def start_batching(self, max_batch_size, max_wait_ms):
+        """Route classifier calls through a MicroBatcher, whose thread becomes the only caller of the model."""
+        from micro_batcher import MicroBatcher
+        self.batcher = MicroBatcher(self.classify, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    name='analysis-batcher')
+
+    def classify(self, image_arrays):
+        """Top-5 (synset, label, score) predictions for each preprocessed (H, W, 3) array, in one model call."""
+        predictions = self.model(np.stack(image_arrays))
+        return decode_top_k(predictions, self.label_synsets, self.label_names, top=5)
+
+    def submit_classification(self, image_array):
+        """A Future for the top-5 predictions of one image, batched with other requests when batching is on."""
+        if self.batcher is not None:
+            return self.batcher.submit(image_array, key=image_array.shape)
+        future = Future()
+        future.set_result(self.classify([image_array])[0])
+        return future
+
+    def input_size(self):
+        return self.model.input_shape[1:3]
+
+    def decode_image(self, image_bytes):
+        """One reduced decode that feeds both the features (orig_np) and the classifier input."""
         try:
-            labels_path = 'PythonScripts/ImageNetLabels.txt'
-            with open(labels_path, 'r') as f:
-                labels = [line.strip() for line in f.readlines()]
-            return labels
-        except FileNotFoundError:
-            return None
+            input_height, input_width = self.input_size()
+            return image_features.decode_for_analysis(image_bytes, WORKING_SIZE, (input_width, input_height))
+        except Exception as e:
+            print(f"Error decoding image: {e}", file=sys.stderr)
+            raise
     
-    def preprocess_image(self, image_bytes):
+    def preprocess_image(self, image):
     
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            image = image.convert('RGB')
-            orig_np = np.array(image)
-            if hasattr(self.model, 'input_shape'):
-                input_height, input_width = self.model.input_shape[1:3]
-            else:
-                input_height, input_width = (260, 260) if hasattr(self.model, 'name') and 'efficient' in self.model.name.lower() else (224, 224)
-            image = image.resize((input_width, input_height))
-            if hasattr(self.model, 'name') and 'efficient' in self.model.name.lower():
-                image_array = tf.keras.preprocessing.image.img_to_array(image)
-                image_array = tf.keras.applications.efficientnet.preprocess_input(image_array)
-            else:
-                image_array = tf.keras.preprocessing.image.img_to_array(image)
-                image_array = tf.keras.applications.mobilenet_v2.preprocess_input(image_array)
-            return tf.expand_dims(image_array, 0), orig_np
+            input_height, input_width = self.input_size()
+            image_array = np.asarray(image.resize((input_width, input_height)), dtype=np.float32)
+            # What keras.applications' preprocess_input does: nothing for EfficientNet, [-1, 1] for MobileNetV2
+            if preprocess_mode(self.model.name) == 'tf':
+                image_array = image_array / 127.5 - 1.0
+            return image_array
         except Exception as e:
             print(f"Error preprocessing image: {e}", file=sys.stderr)
             raise
     
     def find_dominant_colors(self, image_np, n_colors=5):
-        pixels = image_np.reshape(-1, 3)
-        quantized = (pixels // 16) * 16 
-        unique_colors, counts = np.unique(quantized, axis=0, return_counts=True)
-        sorted_idx = np.argsort(-counts)
-        dominant_colors = unique_colors[sorted_idx[:n_colors]]
-        color_percentages = counts[sorted_idx[:n_colors]] / len(pixels)
-        return dominant_colors, color_percentages
+        return image_features.dominant_colors(image_np, n_colors, COLOR_SAMPLE_STRIDE)
     
-    def extract_color_features(self, image_np):
-        """Extract detailed color features from the image."""
-        def rgb_to_hsv(rgb_img):
-            r, g, b = rgb_img[..., 0], rgb_img[..., 1], rgb_img[..., 2]
-            r, g, b = r/255.0, g/255.0, b/255.0
-            maxc = np.maximum(np.maximum(r, g), b)
-            minc = np.minimum(np.minimum(r, g), b)
-            v = maxc
-            deltac = maxc - minc
-            s = np.zeros_like(deltac)
-            s[maxc != 0] = deltac[maxc != 0] / maxc[maxc != 0]
-            h = np.zeros_like(deltac)
-            rc = np.zeros_like(deltac)
-            rc[deltac != 0] = (maxc[deltac != 0] - r[deltac != 0]) / deltac[deltac != 0]
-            gc = np.zeros_like(deltac)
-            gc[deltac != 0] = (maxc[deltac != 0] - g[deltac != 0]) / deltac[deltac != 0]
-            bc = np.zeros_like(deltac)
-            bc[deltac != 0] = (maxc[deltac != 0] - b[deltac != 0]) / deltac[deltac != 0]
-            h[b == maxc] = 4.0 + gc[b == maxc] - rc[b == maxc]
-            h[g == maxc] = 2.0 + rc[g == maxc] - bc[g == maxc]
-            h[r == maxc] = bc[r == maxc] - gc[r == maxc]
-            h[deltac == 0] = 0.0
-            h = (h / 6.0) % 1.0
-            return np.stack((h, s, v), axis=-1)
-        
-        hsv_image = rgb_to_hsv(image_np.astype(np.float32))
+    def extract_color_features(self, image_np, work=None):
+        """Extract detailed color features from the image (statistics on the working image, if given)."""
+        if work is None:
+            work = image_features.working_image(image_np, WORKING_SIZE)
+        stats = image_features.color_statistics(work)
         dominant_colors, color_percentages = self.find_dominant_colors(image_np)
-        rgb_mean = np.mean(image_np, axis=(0, 1))
-        rgb_std = np.std(image_np, axis=(0, 1))
-        hsv_mean = np.mean(hsv_image, axis=(0, 1))
-        hsv_std = np.std(hsv_image, axis=(0, 1))
-        brightness = hsv_mean[2]  
-        saturation = hsv_mean[1]  
+        rgb_mean = stats['rgb_mean']
+        brightness = stats['brightness']
+        saturation = stats['saturation']
         r_g_ratio = rgb_mean[0] / max(rgb_mean[1], 1)
         b_g_ratio = rgb_mean[2] / max(rgb_mean[1], 1)
         color_temp = "warm" if r_g_ratio > b_g_ratio else "cool"
-        contrast = np.mean(rgb_std) / 255.0
+        contrast = np.mean(stats['rgb_std']) / 255.0
         color_variety = min(5, len([c for c in dominant_colors if np.any(c > 50)]))
         is_vibrant = saturation > 0.6 and contrast > 0.15
         is_muted = saturation < 0.3 or (brightness < 0.3 and saturation < 0.5)
@@ -115,72 +138,45 @@ class EnhancedImageAnalyzer:
             'is_muted': bool(is_muted)
         }
     
-    def extract_texture_features(self, image_np):
-        """Extract texture-related features from the image."""
-        gray = np.dot(image_np[...,:3], [0.2989, 0.5870, 0.1140])
-        def simple_edge_detection(gray_img):
-            h, w = gray_img.shape
-            gx = np.zeros((h, w))
-            gy = np.zeros((h, w))
-            gx[:, 1:-1] = gray_img[:, 2:] - gray_img[:, :-2]
-            gy[1:-1, :] = gray_img[2:, :] - gray_img[:-2, :]
-            gradient_magnitude = np.sqrt(gx**2 + gy**2)
-            return gradient_magnitude
-        
-        edge_magnitude = simple_edge_detection(gray)
-        edge_density = np.mean(edge_magnitude) / 255.0
-        
-        def calculate_texture_stats(gray_img, window_size=16):
-            h, w = gray_img.shape
-            
-            
-            if h > 400 or w > 400:
-                scale = 400 / max(h, w)
-                new_h, new_w = int(h * scale), int(w * scale)
-                from PIL import Image
-                gray_img = np.array(Image.fromarray(gray_img.astype(np.uint8)).resize((new_w, new_h)))
-            
-            h, w = gray_img.shape
-            blocks_h = max(1, h // window_size)
-            blocks_w = max(1, w // window_size) 
-            local_std = np.zeros((blocks_h, blocks_w))
-            for i in range(blocks_h):
-                for j in range(blocks_w):
-                    y_start = i * window_size
-                    y_end = min((i + 1) * window_size, h)
-                    x_start = j * window_size
-                    x_end = min((j + 1) * window_size, w)
-                    
-                    block = gray_img[y_start:y_end, x_start:x_end]
-                    local_std[i, j] = np.std(block)
-            
-            
-            texture_contrast = np.std(local_std) / 255.0
-            texture_roughness = np.mean(local_std) / 255.0
-            return texture_contrast, texture_roughness
-        texture_contrast, texture_roughness = calculate_texture_stats(gray)
+    def extract_texture_features(self, image_np, work=None, image=None):
+        """Extract texture-related features from the image (on the working image, if given).
+
+        Edge density is measured on image, the decoded PIL image, when given: image_np may be sampled.
+        """
+        if work is None:
+            work = image_features.working_image(image_np, WORKING_SIZE)
+        stats = image_features.texture_statistics(image if image is not None else image_np, work)
+        edge_density = stats['edge_density']
+        texture_roughness = stats['texture_roughness']
         is_smooth = texture_roughness < 0.1 and edge_density < 0.15
         is_rough = texture_roughness > 0.2 or edge_density > 0.25
         return {
             'edge_density': float(edge_density),
-            'texture_contrast': float(texture_contrast),
+            'texture_contrast': float(stats['texture_contrast']),
             'texture_roughness': float(texture_roughness),
             'is_smooth': bool(is_smooth),
             'is_rough': bool(is_rough)
         }
     
-    def analyze_image(self, image_bytes):
+    def analyze_image(self, image_bytes, labels=False):
+        """Mood, genre hints and image characteristics; labels=True always runs the classifier."""
         try:
-            preprocessed_image, original_image_np = self.preprocess_image(image_bytes)
-            predictions = self.model.predict(preprocessed_image, verbose=0)
-            if hasattr(self.model, 'name') and 'efficient' in self.model.name.lower():
-                top_predictions = tf.keras.applications.efficientnet.decode_predictions(predictions, top=5)[0]
-            else:
-                top_predictions = tf.keras.applications.mobilenet_v2.decode_predictions(predictions, top=5)[0]
-            color_features = self.extract_color_features(original_image_np)
-            texture_features = self.extract_texture_features(original_image_np)
-            mood_mapping = self.get_mood_mapping(color_features, texture_features, top_predictions)
+            image, original_image_np = self.decode_image(image_bytes)
+            classification = None
+            if labels or CNN_MODE == 'always':
+                # The features are computed while the image waits for (and runs in) a classifier batch
+                classification = self.submit_classification(self.preprocess_image(image))
+            work = image_features.working_image(original_image_np, WORKING_SIZE)
+            color_features = self.extract_color_features(original_image_np, work)
+            texture_features = self.extract_texture_features(original_image_np, work, image)
+            mood_scores = self.score_moods(color_features, texture_features)
+            if classification is None and max(mood_scores[2].values()) < DECISIVE_MOOD_SCORE:
+                # Color and texture alone are ambiguous: the content labels may decide the mood
+                classification = self.submit_classification(self.preprocess_image(image))
+            top_predictions = classification.result() if classification is not None else []
+            mood_mapping = self.get_mood_mapping(color_features, texture_features, top_predictions, mood_scores)
             return {
+                'cnn_used': classification is not None,
                 'predictions': [
                     {'label': label, 'confidence': float(score)} 
                     for _, label, score in top_predictions[:5]
@@ -203,9 +199,8 @@ class EnhancedImageAnalyzer:
             print(f"Error in analyze_image: {e}", file=sys.stderr)
             raise
     
-    def get_mood_mapping(self, color_features, texture_features, predictions):
-        """Enhanced mood mapping based on rich image features."""
-       
+    def score_moods(self, color_features, texture_features):
+        """Energy, valence and the score of every mood, from the color and texture features alone."""
         brightness = color_features['brightness']
         saturation = color_features['saturation']
         contrast = color_features['contrast']
@@ -241,8 +236,13 @@ class EnhancedImageAnalyzer:
             "chaotic": edge_density * 0.9 + (is_rough * 0.8) if edge_density > 0.7 and is_rough else 0,
             "dreamy": brightness * 0.6 + (1-contrast) * 0.7 if brightness > 0.6 and contrast < 0.4 else 0
         }
+        return energy, valence, mood_scores
+    
+    def get_mood_mapping(self, color_features, texture_features, predictions, mood_scores=None):
+        """Enhanced mood mapping based on rich image features."""
+        energy, valence, mood_scores = mood_scores or self.score_moods(color_features, texture_features)
         top_mood = max(mood_scores.items(), key=lambda x: x[1])
-        if top_mood[1] < 0.4:
+        if top_mood[1] < DECISIVE_MOOD_SCORE:
             content_mood = self.get_content_based_mood(predictions)
             if content_mood:
                 top_mood = (content_mood, 0.5)
@@ -367,23 +367,61 @@ class EnhancedImageAnalyzer:
                     break
         return list(dict.fromkeys(genres))[:6]  
 
+# Neutral analysis returned when an image cannot be analyzed, so callers can still recommend songs
+def error_result(e):
+    return {
+        "error": str(e),
+        "mood": "error",
+        "genre_hints": ["ambient"],
+        "energy_level": 0.5,
+        "valence": 0.5
+    }
+
 def main():
     sys.stderr.write("Enhanced image analysis script started\n")
     try:
         image_bytes = sys.stdin.buffer.read()
         analyzer = EnhancedImageAnalyzer()
-        result = analyzer.analyze_image(image_bytes)
+        result = analyzer.analyze_image(image_bytes, labels='--labels' in sys.argv[1:])
         print(json.dumps(result))
     except Exception as e:
-        error_result = {
-            "error": str(e),
-            "mood": "error",
-            "genre_hints": ["ambient"],
-            "energy_level": 0.5,
-            "valence": 0.5
-        }
-        print(json.dumps(error_result))
+        print(json.dumps(error_result(e)))
         sys.stderr.write(f"Error in script execution: {e}\n")
 
+def serve():
+    from worker_protocol import claim_stdio, read_frame
+
+    frame_in, frame_out = claim_stdio()
+    analyzer = EnhancedImageAnalyzer()
+    analyzer.warmup()
+    analyzer.start_batching(BATCH_SIZE, BATCH_WAIT_MS)
+    executor = ThreadPoolExecutor(max_workers=MAX_INFLIGHT_REQUESTS, thread_name_prefix='analysis-request')
+
+    def handle(header, payload):
+        request_id = header.get('id')
+        try:
+            result = analyzer.analyze_image(payload, labels=bool(header.get('labels')))
+        except Exception as e:
+            # Same fallback as the CLI: the route still recommends songs for an unreadable image
+            sys.stderr.write(f"Error in image analysis: {e}\n")
+            result = error_result(e)
+        frame_out.write({'type': 'result', 'id': request_id, 'batch_stats': analyzer.batcher.stats()},
+                        json.dumps(result).encode('utf-8'))
+
+    frame_out.write({'type': 'ready', 'pid': os.getpid(), 'max_inflight': MAX_INFLIGHT_REQUESTS})
+    sys.stderr.write(f"Analysis worker {os.getpid()} ready with {analyzer.model.name} ({analyzer.model.backend})\n")
+
+    while True:
+        frame = read_frame(frame_in)
+        if frame is None:
+            break
+        header, payload = frame
+        executor.submit(handle, header, payload)
+
+    executor.shutdown(wait=True)
+
 if __name__ == "__main__":
+    if '--serve' in sys.argv[1:]:
+        serve()
+        sys.exit(0)
     main()
\ No newline at end of file
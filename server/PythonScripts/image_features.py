@@ -0,0 +1,176 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+# Colors are quantized to 4 bits per channel, so every pixel falls into one of 16 ** 3 bins
+COLOR_LEVELS = 16
+COLOR_STEP = 256 // COLOR_LEVELS
+COLOR_BINS = COLOR_LEVELS ** 3
+
+
+def color_histogram(image_np, sample_stride=1):
+    """Pixel counts of the 4096 quantized colors of an (H, W, 3) uint8 image.
+
+    Bin r * 256 + g * 16 + b holds the pixels whose channels fall into levels (r, g, b), so bins
+    are in the same order np.unique would sort the quantized colors in. With sample_stride > 1
+    only every sample_stride-th pixel of every sample_stride-th row is counted.
+    """
+    pixels = image_np[::sample_stride, ::sample_stride, :3] if sample_stride > 1 else image_np[..., :3]
+    levels = np.asarray(pixels, dtype=np.uint8) >> 4
+    keys = levels[..., 0].astype(np.uint16) << 8
+    keys |= levels[..., 1].astype(np.uint16) << 4
+    keys |= levels[..., 2]
+    return np.bincount(keys.ravel(), minlength=COLOR_BINS)
+
+
+def dominant_colors(image_np, n_colors=5, sample_stride=1):
+    """The n_colors most frequent quantized colors and the fraction of (sampled) pixels each covers.
+
+    Matches quantizing every pixel with (pixels // 16) * 16 and counting with np.unique: colors are
+    the lower corner of their bin, and equal counts are ordered by color.
+    """
+    counts = color_histogram(image_np, sample_stride)
+    order = np.argsort(-counts, kind='stable')[:n_colors]
+    order = order[counts[order] > 0]
+    colors = np.stack([order >> 8, (order >> 4) & 0xF, order & 0xF], axis=1) * COLOR_STEP
+    return colors.astype(np.uint8), counts[order] / counts.sum()
+
+
+def reduced_size(size, max_side, min_size):
+    """The smallest (width, height) an image of this size may be decoded at for analysis.
+
+    The long side stays at least max_side (the working image) and each side at least that of
+    min_size (the classifier input). max_side 0 asks for the full size.
+    """
+    width, height = size
+    if not max_side:
+        return size
+    scale = max(max_side / max(width, height), min_size[0] / width, min_size[1] / height)
+    return (min(width, math.ceil(width * scale)), min(height, math.ceil(height * scale)))
+
+
+def decode_for_analysis(image_bytes, max_side, min_size):
+    """Decode an upload once, no larger than the analysis needs. Returns (image, pixels).
+
+    image is the RGB image the classifier input is resized from; pixels is a uint8 array of it,
+    sampled every n-th pixel down to the reduced_size, for the color and texture stages. JPEGs are
+    decoded with DCT scaling (draft), which skips most of the decoding work and never allocates
+    the full-size bitmap. Other formats have no reducing decoder: they are decoded in full, and
+    only the sampled pixels are copied out, never a full-size array.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    target = reduced_size(image.size, max_side, min_size)
+    if image.format == 'JPEG' and target != image.size:
+        image.draft('RGB', target)
+    image = image.convert('RGB')
+    step = min(image.width // target[0], image.height // target[1])
+    if step >= 2:
+        sampled = image.resize((-(-image.width // step), -(-image.height // step)), Image.NEAREST)
+        return image, np.asarray(sampled)
+    return image, np.asarray(image)
+
+
+# ITU-R 601 luma, as the analyzer has always used for its grayscale
+GRAY_WEIGHTS = np.array([0.2989, 0.5870, 0.1140], dtype=np.float32)
+
+# Edge density is measured at this long side: gradients are per pixel, so the same picture has
+# sharper edges the fewer pixels it has. Up to this size the image is used as it is.
+EDGE_SIDE = 1024
+
+
+def working_image(image_np, max_side=1024):
+    """The RGB image as float32 in [0, 255], sampled every n-th pixel so its long side is at most max_side.
+
+    Every color and texture statistic is computed on this one array, so their cost is bounded no
+    matter how large the upload is. Sampling, unlike averaging, keeps the distribution of pixel
+    values, so means, spreads and saturation match the full image closely; max_side 0 keeps it all.
+    """
+    step = -(-max(image_np.shape[:2]) // max_side) if max_side else 1
+    return np.asarray(image_np[::step, ::step, :3], dtype=np.float32)
+
+
+def color_statistics(work):
+    """Per-channel RGB mean and standard deviation, and the mean HSV saturation and value (in [0, 1]).
+
+    Saturation and value only need each pixel's largest and smallest channel; hue is not computed
+    because no feature uses it. Black pixels have saturation 0, as their max - min is 0.
+    """
+    # Channel views and element-wise max/min are far faster than reducing over the length-3 last axis.
+    # Sums are accumulated in float64: float32 drifts by several percent over a 12 MP image.
+    channels = [work[..., c] for c in range(3)]
+    maxc = np.maximum(np.maximum(channels[0], channels[1]), channels[2])
+    delta = maxc - np.minimum(np.minimum(channels[0], channels[1]), channels[2])
+    delta /= np.maximum(maxc, 1e-6)
+    return {
+        'rgb_mean': np.array([channel.mean(dtype=np.float64) for channel in channels]),
+        'rgb_std': np.array([channel.std(dtype=np.float64) for channel in channels]),
+        'saturation': float(delta.mean(dtype=np.float64)),
+        'brightness': float(maxc.mean(dtype=np.float64) / 255.0),
+    }
+
+
+def edge_gray(image, edge_side=EDGE_SIDE):
+    """The float32 grayscale of an RGB image (PIL or uint8 array), box-averaged so its long side is at most edge_side.
+
+    Averaging, unlike sampling, keeps every edge as sharp as it is at edge_side, so edge density
+    does not depend on the size of the upload. Pass the decoded image, not the sampled pixels of
+    decode_for_analysis or working_image. Only the reduced image is allocated.
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(np.ascontiguousarray(image[..., :3]))
+    if edge_side and max(image.size) > edge_side:
+        scale = edge_side / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BOX)
+    return np.asarray(image, dtype=np.float32) @ GRAY_WEIGHTS
+
+
+def edge_density(gray):
+    """Mean central-difference gradient magnitude over the image, in [0, 1] units of 255.
+
+    The outer columns have no horizontal gradient and the outer rows no vertical one.
+    """
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    np.subtract(gray[:, 2:], gray[:, :-2], out=gx[:, 1:-1])
+    np.subtract(gray[2:, :], gray[:-2, :], out=gy[1:-1, :])
+    gx *= gx
+    gy *= gy
+    gx += gy
+    np.sqrt(gx, out=gx)
+    return float(gx.mean(dtype=np.float64) / 255.0)
+
+
+def block_std(gray, block_size=16):
+    """Standard deviation of every full block_size x block_size block of a 2-D array.
+
+    Rows and columns that do not fill a block are left out; an image smaller than a block is one block.
+    """
+    height, width = gray.shape
+    block_h, block_w = min(block_size, height), min(block_size, width)
+    rows, cols = height // block_h, width // block_w
+    blocks = gray[:rows * block_h, :cols * block_w].reshape(rows, block_h, cols, block_w)
+    return blocks.std(axis=(1, 3), dtype=np.float64)
+
+
+def texture_statistics(image, work, texture_side=400, block_size=16, edge_side=EDGE_SIDE):
+    """Edge density of the image at edge_side, and the contrast and roughness of its local texture.
+
+    Edge density is measured on the decoded image (see edge_gray), not on the working image: a
+    sampled image has sharper edges than the one it was sampled from. Local texture is the standard
+    deviation of block_size blocks of the working image's grayscale, scaled so its long side is at
+    most texture_side: roughness is their mean, contrast their spread.
+    """
+    edges = edge_density(edge_gray(image, edge_side))
+    gray = work @ GRAY_WEIGHTS
+    height, width = gray.shape
+    if height > texture_side or width > texture_side:
+        scale = texture_side / max(height, width)
+        gray = np.asarray(Image.fromarray(gray).resize((int(width * scale), int(height * scale))))
+    local_std = block_std(gray, block_size)
+    return {
+        'edge_density': edges,
+        'texture_contrast': float(np.std(local_std) / 255.0),
+        'texture_roughness': float(np.mean(local_std) / 255.0),
+    }
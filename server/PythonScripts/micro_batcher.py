@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collects items submitted from many threads into batches for one model call.
+
+    Items are grouped by a key (for tensors, their shape) because only same-shaped
+    inputs can be stacked. A group is run as soon as it reaches max_batch_size, or
+    once its oldest item has waited max_wait_ms. run_batch receives the list of
+    items and must return a list of results in the same order.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=10, name='micro-batcher'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.groups = OrderedDict()
+        self.condition = threading.Condition()
+        self.batches_run = 0
+        self.items_run = 0
+        self.thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, item, key):
+        future = Future()
+        with self.condition:
+            self.groups.setdefault(key, []).append((time.monotonic(), item, future))
+            self.condition.notify()
+        return future
+
+    def stats(self):
+        with self.condition:
+            return {
+                'batches': self.batches_run,
+                'items': self.items_run,
+                'mean_batch_size': self.items_run / self.batches_run if self.batches_run else 0.0
+            }
+
+    def _next_batch(self):
+        # Called with the condition held. Returns a ready batch or the time to wait for one.
+        now = time.monotonic()
+        wait = None
+        for key, entries in self.groups.items():
+            deadline = entries[0][0] + self.max_wait
+            if len(entries) >= self.max_batch_size or deadline <= now:
+                batch = entries[:self.max_batch_size]
+                remaining = entries[self.max_batch_size:]
+                if remaining:
+                    self.groups[key] = remaining
+                    self.groups.move_to_end(key)
+                else:
+                    del self.groups[key]
+                return batch, None
+            wait = deadline - now if wait is None else min(wait, deadline - now)
+        return None, wait
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                batch, wait = self._next_batch()
+                while batch is None:
+                    self.condition.wait(wait)
+                    batch, wait = self._next_batch()
+
+            futures = [future for _, _, future in batch]
+            try:
+                results = self.run_batch([item for _, item, _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self.condition:
+                self.batches_run += 1
+                self.items_run += len(batch)
+            for future, result in zip(futures, results):
+                future.set_result(result)
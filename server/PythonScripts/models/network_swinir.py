@@ -4,6 +4,8 @@
 # -----------------------------------------------------------------------------------
 
 import math
+import threading
+from collections import OrderedDict
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -62,6 +64,74 @@ def window_reverse(windows, window_size, H, W):
     return x
 
 
+class AttentionMaskCache:
+    r""" Size-keyed LRU cache of SW-MSA attention masks shared by all blocks of a model.
+
+    Args:
+        max_entries (int): Number of masks kept before the least recently used one is evicted. Default: 32
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, block, x_size, device):
+        key = (x_size[0], x_size[1], block.window_size, block.shift_size, str(device))
+        with self.lock:
+            mask = self.masks.get(key)
+            if mask is not None:
+                self.masks.move_to_end(key)
+                self.hits += 1
+                return mask
+            self.misses += 1
+
+        mask = self.build(block, x_size, device)
+        with self.lock:
+            self.masks[key] = mask
+            self.masks.move_to_end(key)
+            while len(self.masks) > self.max_entries:
+                self.masks.popitem(last=False)
+        return mask
+
+    def build(self, block, x_size, device):
+        return block.calculate_mask(x_size).to(device)
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+
+    def __getstate__(self):
+        # copies (deepcopy, quantize_dynamic, pickling) start with an empty cache and a fresh lock
+        return {'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_entries'])
+
+
+class WindowPartitionCache(AttentionMaskCache):
+    r""" Size-keyed LRU cache of token permutations that fuse the cyclic shift with window partitioning.
+
+    For an (H, W) feature map, window_size and shift_size, get() returns (partition, reverse) index
+    tensors of length H*W: x.index_select(1, partition) on (B, H*W, C) tokens equals
+    window_partition(torch.roll(x, -shift)) in one gather, and reverse undoes it in one gather,
+    replacing the two rolls and two permute copies of SwinTransformerBlock.forward. Both are
+    built by running the reference functions on token positions, so results are bit-exact.
+    """
+
+    def build(self, block, x_size, device):
+        H, W = x_size
+        positions = torch.arange(H * W).view(1, H, W, 1)
+        if block.shift_size > 0:
+            positions = torch.roll(positions, shifts=(-block.shift_size, -block.shift_size), dims=(1, 2))
+        partition = window_partition(positions, block.window_size).reshape(-1)
+        reverse = torch.empty_like(partition)
+        reverse[partition] = torch.arange(H * W)
+        return partition.to(device), reverse.to(device)
+
+
 class WindowAttention(nn.Module):
     r""" Window based multi-head self attention (W-MSA) module with relative position bias.
     It supports both of shifted and non-shifted window.
@@ -111,6 +181,42 @@ class WindowAttention(nn.Module):
         trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
 
+        # 'eager' (explicit softmax(q @ k^T + bias + mask) @ v) or 'sdpa' (F.scaled_dot_product_attention)
+        self.attention_backend = 'eager'
+
+        # inference-only state, see freeze_relative_position_bias(); the bias buffer follows
+        # .to()/.half() like the table it is built from but is never saved in the state dict
+        self.register_buffer('frozen_bias', None, persistent=False)
+        self.fold_mask = False
+        self._folded_mask = None
+        self._folded_bias = None
+
+    def get_relative_position_bias(self):
+        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
+        return relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
+
+    def freeze_relative_position_bias(self, fold_mask=False):
+        """Materialize the (nH, N, N) bias once for inference. With fold_mask, the bias is also
+        pre-added to the last attention mask seen, which costs nW*nH*N*N floats per layer."""
+        self.frozen_bias = self.get_relative_position_bias().detach()
+        self.fold_mask = fold_mask
+        self._folded_mask = None
+        self._folded_bias = None
+
+    def unfreeze_relative_position_bias(self):
+        self.frozen_bias = None
+        self.fold_mask = False
+        self._folded_mask = None
+        self._folded_bias = None
+
+    def _get_folded_bias(self, mask):
+        # masks come from the shared mask cache, so the same tensor object means the same size
+        if self._folded_mask is not mask:
+            self._folded_bias = (self.frozen_bias.unsqueeze(0) + mask.unsqueeze(1)).unsqueeze(0)
+            self._folded_mask = mask
+        return self._folded_bias
+
     def forward(self, x, mask=None):
         """
         Args:
@@ -121,21 +227,30 @@ class WindowAttention(nn.Module):
         qkv = self.qkv(x).reshape(B_, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]  # make torchscript happy (cannot use tensor as tuple)
 
+        if self.attention_backend == 'sdpa':
+            return self.forward_sdpa(q, k, v, mask)
+
         q = q * self.scale
         attn = (q @ k.transpose(-2, -1))
 
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
-
-        if mask is not None:
+        if self.frozen_bias is not None and self.fold_mask and mask is not None:
             nW = mask.shape[0]
-            attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
-            attn = attn.view(-1, self.num_heads, N, N)
-            attn = self.softmax(attn)
+            attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + self._get_folded_bias(mask)
+            attn = self.softmax(attn.view(-1, self.num_heads, N, N))
         else:
-            attn = self.softmax(attn)
+            if self.frozen_bias is not None:
+                relative_position_bias = self.frozen_bias
+            else:
+                relative_position_bias = self.get_relative_position_bias()
+            attn = attn + relative_position_bias.unsqueeze(0)
+
+            if mask is not None:
+                nW = mask.shape[0]
+                attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
+                attn = attn.view(-1, self.num_heads, N, N)
+                attn = self.softmax(attn)
+            else:
+                attn = self.softmax(attn)
 
         attn = self.attn_drop(attn)
 
@@ -144,6 +259,32 @@ class WindowAttention(nn.Module):
         x = self.proj_drop(x)
         return x
 
+    def forward_sdpa(self, q, k, v, mask=None):
+        """Same attention through F.scaled_dot_product_attention, with bias and mask as an additive attn_mask.
+        Windows are viewed as (B, nW, nH, N, hd) so the (nW, nH, N, N) mask broadcasts without copies."""
+        B_, nH, N, head_dim = q.shape
+        if self.frozen_bias is not None and self.fold_mask and mask is not None:
+            nW = mask.shape[0]
+            attn_mask = self._get_folded_bias(mask)
+        else:
+            bias = self.frozen_bias if self.frozen_bias is not None else self.get_relative_position_bias()
+            if mask is not None:
+                nW = mask.shape[0]
+                attn_mask = (bias.unsqueeze(0) + mask.unsqueeze(1)).unsqueeze(0)
+            else:
+                nW = 1
+                attn_mask = bias.unsqueeze(0)
+
+        shape = (B_ // nW, nW, nH, N, head_dim)
+        x = F.scaled_dot_product_attention(
+            q.view(shape), k.view(shape), v.view(shape), attn_mask=attn_mask.to(q.dtype),
+            dropout_p=self.attn_drop.p if self.training else 0., scale=self.scale)
+
+        x = x.view(B_, nH, N, head_dim).transpose(1, 2).reshape(B_, N, nH * head_dim)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
+
     def extra_repr(self) -> str:
         return f'dim={self.dim}, window_size={self.window_size}, num_heads={self.num_heads}'
 
@@ -212,6 +353,9 @@ class SwinTransformerBlock(nn.Module):
             attn_mask = None
 
         self.register_buffer("attn_mask", attn_mask)
+        # set by SwinIR so masks for other input sizes are computed once per model, not once per block
+        self.mask_cache = None
+        self.partition_cache = None
 
     def calculate_mask(self, x_size):
         # calculate attention mask for SW-MSA
@@ -243,34 +387,48 @@ class SwinTransformerBlock(nn.Module):
 
         shortcut = x
         x = self.norm1(x)
-        x = x.view(B, H, W, C)
 
-        # cyclic shift
-        if self.shift_size > 0:
-            shifted_x = torch.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+        if self.partition_cache is not None:
+            # cyclic shift and window partition as one gather
+            partition, reverse = self.partition_cache.get(self, x_size, x.device)
+            x_windows = x.index_select(1, partition).view(-1, self.window_size * self.window_size, C)
         else:
-            shifted_x = x
+            x = x.view(B, H, W, C)
 
-        # partition windows
-        x_windows = window_partition(shifted_x, self.window_size)  # nW*B, window_size, window_size, C
-        x_windows = x_windows.view(-1, self.window_size * self.window_size, C)  # nW*B, window_size*window_size, C
+            # cyclic shift
+            if self.shift_size > 0:
+                shifted_x = torch.roll(x, shifts=(-self.shift_size, -self.shift_size), dims=(1, 2))
+            else:
+                shifted_x = x
+
+            # partition windows
+            x_windows = window_partition(shifted_x, self.window_size)  # nW*B, window_size, window_size, C
+            x_windows = x_windows.view(-1, self.window_size * self.window_size, C)  # nW*B, window_size*window_size, C
 
         # W-MSA/SW-MSA (to be compatible for testing on images whose shapes are the multiple of window size
         if self.input_resolution == x_size:
             attn_windows = self.attn(x_windows, mask=self.attn_mask)  # nW*B, window_size*window_size, C
+        elif self.shift_size == 0:
+            attn_windows = self.attn(x_windows, mask=None)
+        elif self.mask_cache is not None:
+            attn_windows = self.attn(x_windows, mask=self.mask_cache.get(self, x_size, x.device))
         else:
             attn_windows = self.attn(x_windows, mask=self.calculate_mask(x_size).to(x.device))
 
-        # merge windows
-        attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
-        shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
-
-        # reverse cyclic shift
-        if self.shift_size > 0:
-            x = torch.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
+        if self.partition_cache is not None:
+            # merge windows and reverse the cyclic shift as one gather
+            x = attn_windows.view(B, H * W, C).index_select(1, reverse)
         else:
-            x = shifted_x
-        x = x.view(B, H * W, C)
+            # merge windows
+            attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
+            shifted_x = window_reverse(attn_windows, self.window_size, H, W)  # B H' W' C
+
+            # reverse cyclic shift
+            if self.shift_size > 0:
+                x = torch.roll(shifted_x, shifts=(self.shift_size, self.shift_size), dims=(1, 2))
+            else:
+                x = shifted_x
+            x = x.view(B, H * W, C)
 
         # FFN
         x = shortcut + self.drop_path(x)
@@ -282,9 +440,9 @@ class SwinTransformerBlock(nn.Module):
         return f"dim={self.dim}, input_resolution={self.input_resolution}, num_heads={self.num_heads}, " \
                f"window_size={self.window_size}, shift_size={self.shift_size}, mlp_ratio={self.mlp_ratio}"
 
-    def flops(self):
+    def flops(self, x_size=None):
         flops = 0
-        H, W = self.input_resolution
+        H, W = x_size or self.input_resolution
         # norm1
         flops += self.dim * H * W
         # W-MSA/SW-MSA
@@ -339,8 +497,8 @@ class PatchMerging(nn.Module):
     def extra_repr(self) -> str:
         return f"input_resolution={self.input_resolution}, dim={self.dim}"
 
-    def flops(self):
-        H, W = self.input_resolution
+    def flops(self, x_size=None):
+        H, W = x_size or self.input_resolution
         flops = H * W * self.dim
         flops += (H // 2) * (W // 2) * 4 * self.dim * 2 * self.dim
         return flops
@@ -407,12 +565,12 @@ class BasicLayer(nn.Module):
     def extra_repr(self) -> str:
         return f"dim={self.dim}, input_resolution={self.input_resolution}, depth={self.depth}"
 
-    def flops(self):
+    def flops(self, x_size=None):
         flops = 0
         for blk in self.blocks:
-            flops += blk.flops()
+            flops += blk.flops(x_size)
         if self.downsample is not None:
-            flops += self.downsample.flops()
+            flops += self.downsample.flops(x_size)
         return flops
 
 
@@ -481,13 +639,13 @@ class RSTB(nn.Module):
     def forward(self, x, x_size):
         return self.patch_embed(self.conv(self.patch_unembed(self.residual_group(x, x_size), x_size))) + x
 
-    def flops(self):
+    def flops(self, x_size=None):
         flops = 0
-        flops += self.residual_group.flops()
-        H, W = self.input_resolution
+        flops += self.residual_group.flops(x_size)
+        H, W = x_size or self.input_resolution
         flops += H * W * self.dim * self.dim * 9
-        flops += self.patch_embed.flops()
-        flops += self.patch_unembed.flops()
+        flops += self.patch_embed.flops(x_size)
+        flops += self.patch_unembed.flops(x_size)
 
         return flops
 
@@ -527,9 +685,9 @@ class PatchEmbed(nn.Module):
             x = self.norm(x)
         return x
 
-    def flops(self):
+    def flops(self, x_size=None):
         flops = 0
-        H, W = self.img_size
+        H, W = x_size or self.img_size
         if self.norm is not None:
             flops += H * W * self.embed_dim
         return flops
@@ -564,7 +722,7 @@ class PatchUnEmbed(nn.Module):
         x = x.transpose(1, 2).view(B, self.embed_dim, x_size[0], x_size[1])  # B Ph*Pw C
         return x
 
-    def flops(self):
+    def flops(self, x_size=None):
         flops = 0
         return flops
 
@@ -578,6 +736,8 @@ class Upsample(nn.Sequential):
     """
 
     def __init__(self, scale, num_feat):
+        self.scale = scale
+        self.num_feat = num_feat
         m = []
         if (scale & (scale - 1)) == 0:  # scale = 2^n
             for _ in range(int(math.log(scale, 2))):
@@ -590,6 +750,16 @@ class Upsample(nn.Sequential):
             raise ValueError(f'scale {scale} is not supported. ' 'Supported scales: 2^n and 3.')
         super(Upsample, self).__init__(*m)
 
+    def flops(self, x_size):
+        H, W = x_size
+        if self.scale == 3:
+            return H * W * self.num_feat * 9 * self.num_feat * 9
+        flops = 0
+        for _ in range(int(math.log(self.scale, 2))):
+            flops += H * W * self.num_feat * 4 * self.num_feat * 9
+            H, W = H * 2, W * 2
+        return flops
+
 
 class UpsampleOneStep(nn.Sequential):
     """UpsampleOneStep module (the difference with Upsample is that it always only has 1conv + 1pixelshuffle)
@@ -602,16 +772,19 @@ class UpsampleOneStep(nn.Sequential):
     """
 
     def __init__(self, scale, num_feat, num_out_ch, input_resolution=None):
+        self.scale = scale
         self.num_feat = num_feat
+        self.num_out_ch = num_out_ch
         self.input_resolution = input_resolution
         m = []
         m.append(nn.Conv2d(num_feat, (scale ** 2) * num_out_ch, 3, 1, 1))
         m.append(nn.PixelShuffle(scale))
         super(UpsampleOneStep, self).__init__(*m)
 
-    def flops(self):
-        H, W = self.input_resolution
-        flops = H * W * self.num_feat * 3 * 9
+    def flops(self, x_size=None):
+        H, W = x_size or self.input_resolution
+        # the 3x3 conv produces scale**2 * num_out_ch channels per input pixel
+        flops = H * W * self.num_feat * self.scale ** 2 * self.num_out_ch * 9
         return flops
 
 
@@ -763,6 +936,16 @@ class SwinIR(nn.Module):
 
         self.apply(self._init_weights)
 
+        # one attention mask cache shared by every shifted block
+        self.mask_cache = AttentionMaskCache()
+        # and one cache of fused shift + partition indices, used by the shifted blocks only:
+        # without a roll, the gather is slower than window_partition's permute copy
+        self.partition_cache = WindowPartitionCache()
+        for module in self.modules():
+            if isinstance(module, SwinTransformerBlock):
+                module.mask_cache = self.mask_cache
+                module.partition_cache = self.partition_cache if module.shift_size > 0 else None
+
     def _init_weights(self, m):
         if isinstance(m, nn.Linear):
             trunc_normal_(m.weight, std=.02)
@@ -787,6 +970,53 @@ class SwinIR(nn.Module):
         x = F.pad(x, (0, mod_pad_w, 0, mod_pad_h), 'reflect')
         return x
 
+    def precompute_attn_masks(self, sizes, device='cpu'):
+        """Fill the mask and window partition caches for input sizes (H, W) seen at inference,
+        e.g. the worker's tile size."""
+        for h, w in sizes:
+            x_size = (h + (self.window_size - h % self.window_size) % self.window_size,
+                      w + (self.window_size - w % self.window_size) % self.window_size)
+            for module in self.modules():
+                if not isinstance(module, SwinTransformerBlock):
+                    continue
+                if module.partition_cache is not None:
+                    module.partition_cache.get(module, x_size, device)
+                if module.shift_size > 0 and x_size != module.input_resolution:
+                    self.mask_cache.get(module, x_size, device)
+
+    def set_window_partition(self, mode):
+        """Select 'index' (fused shift + partition gathers, the default) or 'view' (torch.roll and
+        window_partition/window_reverse) for the shifted SwinTransformerBlocks. Unshifted blocks
+        always use the view path."""
+        if mode not in ('index', 'view'):
+            raise ValueError(f'window partition {mode} is not supported. Supported modes: index and view.')
+        for module in self.modules():
+            if isinstance(module, SwinTransformerBlock):
+                use_index = mode == 'index' and module.shift_size > 0
+                module.partition_cache = self.partition_cache if use_index else None
+
+    def freeze_for_inference(self, fold_masks=False):
+        """Precompute weight-only tensors for inference. Call again after loading new weights,
+        and call unfreeze() before training."""
+        for module in self.modules():
+            if isinstance(module, WindowAttention):
+                module.freeze_relative_position_bias(fold_mask=fold_masks)
+
+    def set_attention_backend(self, backend):
+        """Select 'eager' or 'sdpa' (torch.nn.functional.scaled_dot_product_attention) for every WindowAttention."""
+        if backend not in ('eager', 'sdpa'):
+            raise ValueError(f'attention backend {backend} is not supported. Supported backends: eager and sdpa.')
+        if backend == 'sdpa' and not hasattr(F, 'scaled_dot_product_attention'):
+            raise ValueError('attention backend sdpa needs torch>=2.1')
+        for module in self.modules():
+            if isinstance(module, WindowAttention):
+                module.attention_backend = backend
+
+    def unfreeze(self):
+        for module in self.modules():
+            if isinstance(module, WindowAttention):
+                module.unfreeze_relative_position_bias()
+
     def forward_features(self, x):
         x_size = (x.shape[2], x.shape[3])
         x = self.patch_embed(x)
@@ -839,15 +1069,38 @@ class SwinIR(nn.Module):
 
         return x[:, :, :H*self.upscale, :W*self.upscale]
 
-    def flops(self):
+    def flops(self, x_size=None):
+        """Multiply-accumulates of one forward pass, for the training resolution or for an input of
+        x_size = (H, W) (padded to the window size the same way forward() pads it)."""
         flops = 0
-        H, W = self.patches_resolution
+        if x_size is None:
+            H, W = self.patches_resolution
+        else:
+            H = x_size[0] + (self.window_size - x_size[0] % self.window_size) % self.window_size
+            W = x_size[1] + (self.window_size - x_size[1] % self.window_size) % self.window_size
+            x_size = (H, W)
         flops += H * W * 3 * self.embed_dim * 9
-        flops += self.patch_embed.flops()
+        flops += self.patch_embed.flops(x_size)
         for i, layer in enumerate(self.layers):
-            flops += layer.flops()
+            flops += layer.flops(x_size)
         flops += H * W * 3 * self.embed_dim * self.embed_dim
-        flops += self.upsample.flops()
+        if self.upsampler == 'pixelshuffle':
+            num_feat = self.conv_last.in_channels
+            flops += H * W * self.embed_dim * num_feat * 9
+            flops += self.upsample.flops((H, W))
+            flops += H * W * self.upscale ** 2 * num_feat * 3 * 9
+        elif self.upsampler == 'pixelshuffledirect':
+            flops += self.upsample.flops((H, W))
+        elif self.upsampler == 'nearest+conv':
+            num_feat = self.conv_hr.in_channels
+            flops += H * W * self.embed_dim * num_feat * 9
+            # conv_up1 at 2x, conv_up2 at 4x, then conv_hr and conv_last at the output size
+            flops += H * W * 4 * num_feat * num_feat * 9
+            if self.upscale == 4:
+                flops += H * W * 16 * num_feat * num_feat * 9
+            flops += H * W * self.upscale ** 2 * (num_feat * num_feat + num_feat * 3) * 9
+        else:
+            flops += H * W * self.embed_dim * 3 * 9
         return flops
 
 
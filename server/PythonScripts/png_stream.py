@@ -0,0 +1,54 @@
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG filter type 1 ("Sub"): each byte minus the same channel of the pixel to its left
+FILTER_SUB = 1
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+
+
+class PngStreamWriter:
+    """Encode an 8-bit RGB PNG incrementally, handing bytes to `write` as rows arrive.
+
+    Rows can be added in any number of bands from top to bottom; every band is compressed
+    and flushed as its own IDAT chunk, so a consumer can start sending the file before the
+    bottom of the image exists.
+    """
+
+    def __init__(self, write, width, height, compress_level=6):
+        self.write = write
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+        ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+        self.write(PNG_SIGNATURE + _chunk(b'IHDR', ihdr))
+
+    def write_rows(self, rows):
+        """rows: uint8 array of shape (n, width, 3)."""
+        rows = np.ascontiguousarray(rows, dtype=np.uint8)
+        count = rows.shape[0]
+        if rows.shape[1:] != (self.width, 3) or self.rows_written + count > self.height:
+            raise ValueError(f"Unexpected rows of shape {rows.shape} at row {self.rows_written}")
+
+        flat = rows.reshape(count, self.width * 3)
+        filtered = np.empty((count, self.width * 3 + 1), dtype=np.uint8)
+        filtered[:, 0] = FILTER_SUB
+        filtered[:, 1:4] = flat[:, :3]
+        # uint8 arithmetic wraps modulo 256, exactly as the PNG filter specifies
+        np.subtract(flat[:, 3:], flat[:, :-3], out=filtered[:, 4:])
+
+        data = self.compressor.compress(filtered.tobytes()) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            self.write(_chunk(b'IDAT', data))
+        self.rows_written += count
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG closed after {self.rows_written} of {self.height} rows")
+        self.write(_chunk(b'IDAT', self.compressor.flush()) + _chunk(b'IEND', b''))
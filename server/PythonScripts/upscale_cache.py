@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import uuid
+
+# Bump when the stored bytes for the same key would change (encoder, blending, ...)
+CACHE_VERSION = 1
+READ_CHUNK_BYTES = 256 * 1024
+
+
+class CacheWriter:
+    """Collects one result in a private temp file; commit() publishes it atomically."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.path = cache.path(key)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # unique per process and thread, so concurrent writers of the same key never share a file
+        self.tmp_path = f"{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        self.file = open(self.tmp_path, 'wb')
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        self.file.close()
+        # os.replace is atomic: readers see either no entry or a complete one, and when two
+        # workers store the same key the last one simply wins with identical bytes
+        os.replace(self.tmp_path, self.path)
+        self.cache._stored(self.size)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class UpscaleCache:
+    """Content-addressed on-disk cache of upscaled PNGs, shared by every worker on the host.
+
+    Entries are named by the SHA-256 of the input bytes and the output-affecting config, so a
+    repeated upload is served without decoding through the model. The directory is kept under
+    max_bytes by evicting least recently used entries (file mtime, refreshed on every hit).
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, image_data, config):
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'version': CACHE_VERSION, **config}, sort_keys=True).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(image_data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        # two-level layout keeps directories small
+        return os.path.join(self.directory, key[:2], key + '.png')
+
+    def open(self, *keys):
+        """Open the first cached result among keys for reading, or return None on a miss.
+
+        Several keys are for requests any of several results would answer (e.g. tier 'auto');
+        they count as one lookup in the stats.
+        """
+        for key in keys:
+            path = self.path(key)
+            try:
+                cached = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._count('hits')
+            return cached
+        self._count('misses')
+        return None
+
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+        return counters
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _stored(self, size):
+        self._count('stores')
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.png'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes.
+
+        Runs after every store; a store follows a full SwinIR pass, so one directory scan per
+        store is negligible, and it keeps the cap correct with several workers writing.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._count('evictions')
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def create_result_cache(directory, max_mb):
+    """The shared result cache, or None when disabled (max_mb <= 0) or the directory is unusable."""
+    if max_mb <= 0:
+        return None
+    try:
+        return UpscaleCache(directory, int(max_mb * 1024 * 1024))
+    except OSError as e:
+        print(f"Upscale result cache disabled: {e}", file=sys.stderr)
+        return None
+
+
+def copy_cached(cached, write):
+    with cached:
+        for block in iter(lambda: cached.read(READ_CHUNK_BYTES), b''):
+            write(block)
@@ -0,0 +1,59 @@
+import json
+import struct
+import sys
+import threading
+
+# Every frame is: uint32 header length, uint32 payload length (big-endian),
+# a UTF-8 JSON header and a raw binary payload. The same framing is used in
+# both directions between the Node server and the resident Python workers.
+FRAME_PREFIX = struct.Struct('>II')
+
+
+def _read_exact(stream, size):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(stream):
+    """Read one frame from a binary stream. Returns (header, payload) or None on EOF."""
+    prefix = _read_exact(stream, FRAME_PREFIX.size)
+    if prefix is None:
+        return None
+    header_len, payload_len = FRAME_PREFIX.unpack(prefix)
+    header_bytes = _read_exact(stream, header_len)
+    payload = _read_exact(stream, payload_len) if payload_len else b''
+    if header_bytes is None or payload is None:
+        return None
+    return json.loads(header_bytes.decode('utf-8')), payload
+
+
+class FrameWriter:
+    """Thread-safe frame writer so concurrent requests never interleave bytes."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, header, payload=b''):
+        header_bytes = json.dumps(header).encode('utf-8')
+        with self.lock:
+            self.stream.write(FRAME_PREFIX.pack(len(header_bytes), len(payload)))
+            self.stream.write(header_bytes)
+            if payload:
+                self.stream.write(payload)
+            self.stream.flush()
+
+
+def claim_stdio():
+    """Take over stdin/stdout for framing and route stray prints to stderr."""
+    frame_in = sys.stdin.buffer
+    frame_out = FrameWriter(sys.stdout.buffer)
+    sys.stdout = sys.stderr
+    return frame_in, frame_out
@@ -1,65 +1,43 @@
-const { spawn } = require('child_process');
 const path = require('path');
+const { PythonWorkerPool } = require('../../services/pythonWorkerPool');
 
-class ImageAnalysis {
-    async analyzeImage(imageBuffer) {
-        return new Promise((resolve, reject) => {
-            const pythonProcess = spawn('python', [
-                path.join(__dirname, '../../PythonScripts/image_analysis.py')
-            ]);
-
-            let dataString = '';
-            let errorString = '';
-
-            pythonProcess.stdout.on('data', (data) => {
-                dataString += data.toString();
-            });
-
-            pythonProcess.stderr.on('data', (data) => {
-                errorString += data.toString();
-                console.error(`Python error: ${data.toString()}`);
-            });
+// Resident analyzers: TensorFlow and the classifier are loaded and warmed up once per worker
+// instead of once per request. Each worker handles several requests at a time.
+const analysisWorkerPool = new PythonWorkerPool({
+    name: 'Analysis',
+    scriptPath: path.join(__dirname, '../../PythonScripts/image_analysis.py'),
+    size: parseInt(process.env.ANALYSIS_WORKERS, 10) || 1,
+    timeoutMs: parseInt(process.env.ANALYSIS_REQUEST_TIMEOUT_MS, 10) || 60000
+});
 
-            pythonProcess.on('error', (error) => {
-                console.error('Failed to spawn Python process:', error);
-                reject(error);
-            });
+// How often the classifier ran or was skipped because color and texture already decided the mood.
+// Counted here from each result's cnn_used, so the numbers cover every worker and survive restarts.
+const cnnCounters = { used: 0, skipped: 0 };
 
-            pythonProcess.on('close', (code) => {
-                if (code !== 0) {
-                    console.error(`Python process exited with code ${code}`);
-                    console.error('Error output:', errorString);
-                    reject(new Error(`Python process failed: ${errorString}`));
-                    return;
-                }
+const analysisStats = () => {
+    const total = cnnCounters.used + cnnCounters.skipped;
+    return {
+        ...analysisWorkerPool.stats(),
+        cnn: { ...cnnCounters, skipRate: total ? cnnCounters.skipped / total : 0 }
+    };
+};
 
-                try {
-                    const jsonStartIndex = dataString.indexOf('{');
-                    const jsonEndIndex = dataString.lastIndexOf('}');
-
-                    if (jsonStartIndex === -1 || jsonEndIndex === -1) {
-                        throw new Error('No valid JSON output found');
-                    }
-
-                    const jsonString = dataString.slice(jsonStartIndex, jsonEndIndex + 1);
-                    const result = JSON.parse(jsonString);
-                    console.log('Python Analysis:', result);
-                    resolve(result);
-                } catch (error) {
-                    console.error('Error parsing JSON output:', error);
-                    console.error('Raw output:', dataString);
-                    reject(error);
-                }
-            });
-
-            try {
-                pythonProcess.stdin.write(imageBuffer);
-                pythonProcess.stdin.end();
-            } catch (error) {
-                console.error('Error writing to Python process:', error);
-                reject(error);
+class ImageAnalysis {
+    // labels: run the classifier even when the mood does not need it, so predictions are always filled
+    async analyzeImage(imageBuffer, { labels = false } = {}) {
+        try {
+            const { payload } = await analysisWorkerPool.request({ labels }, imageBuffer);
+            const result = JSON.parse(payload.toString('utf8'));
+            // A result with an error is the worker's neutral fallback for an image it could not read
+            if (!result.error) {
+                cnnCounters[result.cnn_used ? 'used' : 'skipped']++;
             }
-        });
+            console.log('Python Analysis:', result);
+            return result;
+        } catch (error) {
+            console.error('Image analysis error:', error.message);
+            throw error;
+        }
     }
 
     generateDescription(imageAnalysis) {
@@ -84,4 +62,4 @@ class ImageAnalysis {
     }
 }
 
-module.exports = { ImageAnalysis };
\ No newline at end of file
+module.exports = { ImageAnalysis, analysisWorkerPool, analysisStats };
\ No newline at end of file
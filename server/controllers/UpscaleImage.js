@@ -1,47 +1,162 @@
-const { spawn } = require('child_process');
+const os = require('os');
 const path = require('path');
+const { PythonWorkerPool } = require('../services/pythonWorkerPool');
+
+const cpuCount = typeof os.availableParallelism === 'function' ? os.availableParallelism() : os.cpus().length;
+const upscaleWorkers = parseInt(process.env.UPSCALE_WORKERS, 10) || 1;
+// Split the cores between the workers instead of letting every worker's torch use all of them
+const upscaleThreadsPerWorker = parseInt(process.env.UPSCALE_THREADS_PER_WORKER, 10)
+    || Math.max(1, Math.floor(cpuCount / upscaleWorkers));
+const pinUpscaleWorkers = process.env.UPSCALE_PIN_CORES === '1';
+
+const upscaleWorkerEnv = (index) => {
+    const env = {
+        UPSCALE_NUM_THREADS: String(upscaleThreadsPerWorker),
+        OMP_NUM_THREADS: String(upscaleThreadsPerWorker),
+        MKL_NUM_THREADS: String(upscaleThreadsPerWorker)
+    };
+    if (pinUpscaleWorkers) {
+        // Worker i gets the next block of cores, wrapping around when workers * threads > cores
+        const cores = [];
+        for (let offset = 0; offset < upscaleThreadsPerWorker; offset++) {
+            cores.push((index * upscaleThreadsPerWorker + offset) % cpuCount);
+        }
+        env.UPSCALE_CPU_AFFINITY = [...new Set(cores)].join(',');
+    }
+    return env;
+};
+
+// Resident SwinIR workers: the model is loaded once per worker instead of once per request
+const upscaleWorkerPool = new PythonWorkerPool({
+    name: 'Upscale',
+    scriptPath: path.join(__dirname, '..', 'PythonScripts', 'Upscale.py'),
+    size: upscaleWorkers,
+    workerEnv: upscaleWorkerEnv,
+    timeoutMs: parseInt(process.env.UPSCALE_REQUEST_TIMEOUT_MS, 10) || 300000
+});
+
+// Result cache outcomes reported by the workers (the cache itself is shared on disk), and how many
+// tiles went through SwinIR or cheap interpolation (UPSCALE_DETAIL_THRESHOLD)
+const cacheCounters = { hits: 0, misses: 0 };
+const tileCounters = { swinir: 0, interpolated: 0 };
+
+const recordResult = ({ cache, tiles }) => {
+    if (cache === 'hit') {
+        cacheCounters.hits++;
+    } else if (cache === 'miss') {
+        cacheCounters.misses++;
+    }
+    for (const [path, count] of Object.entries(tiles || {})) {
+        tileCounters[path] = (tileCounters[path] || 0) + count;
+    }
+};
+
+const upscaleStats = () => {
+    const totalTiles = tileCounters.swinir + tileCounters.interpolated;
+    return {
+        ...upscaleWorkerPool.stats(),
+        cache: { ...cacheCounters },
+        tiles: { ...tileCounters, interpolatedFraction: totalTiles ? tileCounters.interpolated / totalTiles : 0 }
+    };
+};
+
+const parseSettings = (settings) => {
+    if (!settings) {
+        return {};
+    }
+    if (typeof settings === 'object') {
+        return settings;
+    }
+    try {
+        return JSON.parse(settings);
+    } catch (error) {
+        return {};
+    }
+};
+
+// The base64 JSON body is kept for clients that ask for it (?format=json or Accept: application/json)
+const wantsJson = (req) => req.query.format === 'json'
+    || (req.query.format !== 'png' && req.accepts(['image/png', 'application/json']) === 'application/json');
+
+// Bytes of streamed PNG a response may hold unsent before the client is treated as stalled and cut off.
+// Waiting for 'drain' is not an option: one worker's output carries every request it is running.
+const maxStreamBufferBytes = (parseFloat(process.env.UPSCALE_STREAM_MAX_BUFFER_MB) || 64) * 1024 * 1024;
+
+// Requests the workers refuse up front because their predicted time/memory exceeds the budgets
+const sendOverBudget = (res, error) => res.status(413).json({
+    error: error.message,
+    estimate: error.details
+});
 
 const enhanceImage = async (req, res) => {
     if (!req.file) {
       return res.status(400).send('No file uploaded.');
     }
-  
-    try {
-      const pythonScriptPath = path.join(__dirname, '..', 'PythonScripts', 'Upscale.py');
-      const pythonProcess = spawn('python', [pythonScriptPath, JSON.stringify(req.body.settings)]);
-  
-      let output = Buffer.from([]);
-      let errorOutput = '';
-  
-      pythonProcess.stdout.on('data', (data) => {
-        output = Buffer.concat([output, data]);
-      });
-  
-      pythonProcess.stderr.on('data', (data) => {
-        errorOutput += data.toString();
-        console.error('Python Error:', data.toString());
-      });
-  
-      pythonProcess.stdin.write(req.file.buffer);
-      pythonProcess.stdin.end();
-  
-      pythonProcess.on('close', (code) => {
-        if (code !== 0) {
-          console.error('Process exited with code:', code);
-          console.error('Error output:', errorOutput);
-          return res.status(500).send('Image processing failed');
-        }
-  
-        res.json({ 
-          image: output.toString('base64'),
+
+    const settings = parseSettings(req.body.settings);
+
+    if (wantsJson(req)) {
+      try {
+        const { header, payload } = await upscaleWorkerPool.request({ settings }, req.file.buffer);
+        recordResult(header);
+
+        res.json({
+          image: payload.toString('base64'),
           message: 'Image upscaled successfully with SwinIR!'
         });
+      } catch (error) {
+        console.error('Upscale error:', error.message);
+        if (error.code === 'over_budget') {
+          return sendOverBudget(res, error);
+        }
+        res.status(500).send('Image processing failed');
+      }
+      return;
+    }
+
+    // Stream the PNG as the worker encodes it, so no full-size copy is ever held here. Once the client
+    // is gone, or stalled with too much unsent, the remaining chunks are dropped; the worker still
+    // finishes and caches the result.
+    let abandoned = false;
+    res.on('close', () => {
+      abandoned = !res.writableFinished;
+    });
+    try {
+      const { header } = await upscaleWorkerPool.request({ settings, stream: true }, req.file.buffer, {
+        onChunk: (chunk) => {
+          if (abandoned || res.destroyed) {
+            return;
+          }
+          if (res.writableLength + chunk.length > maxStreamBufferBytes) {
+            abandoned = true;
+            console.error(`Upscale client stalled with ${res.writableLength} bytes unsent; closing the response`);
+            res.destroy();
+            return;
+          }
+          if (!res.headersSent) {
+            res.status(200).type('image/png');
+          }
+          res.write(chunk);
+        }
       });
-  
+      recordResult(header);
+      if (!abandoned && !res.destroyed) {
+        res.end();
+      }
     } catch (error) {
-      console.error('Script execution error:', error);
-      res.status(500).send(`Failed to process image: ${error.message}`);
+      console.error('Upscale error:', error.message);
+      if (abandoned || res.destroyed) {
+        return;
+      }
+      if (res.headersSent) {
+        // Part of the image is already out; cut the connection so the client sees a failed download
+        res.destroy(error);
+      } else if (error.code === 'over_budget') {
+        sendOverBudget(res, error);
+      } else {
+        res.status(500).send('Image processing failed');
+      }
     }
   };
-  
-  module.exports = { enhanceImage };
\ No newline at end of file
+
+  module.exports = { enhanceImage, upscaleWorkerPool, upscaleStats };
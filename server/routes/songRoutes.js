@@ -278,7 +278,11 @@ router.post('/recommend-song', upload.single('image'), async (req, res) => {
             }
         }
 
-        const imageAnalysis = await songRecommender.imageAnalysis.analyzeImage(req.file.buffer);
+        // ?labels=1 always returns classifier predictions; otherwise they are only computed when
+        // color and texture leave the mood ambiguous
+        const imageAnalysis = await songRecommender.imageAnalysis.analyzeImage(req.file.buffer, {
+            labels: req.query.labels === '1'
+        });
 
         if (!imageAnalysis) {
             return res.status(500).json({ error: 'Failed to analyze image' });
@@ -310,7 +314,8 @@ router.post('/recommend-song', upload.single('image'), async (req, res) => {
                 energy_level: imageAnalysis.energy_level,
                 valence: imageAnalysis.valence,
                 genre_hints: imageAnalysis.genre_hints,
-                predictions: imageAnalysis.predictions
+                predictions: imageAnalysis.predictions,
+                cnn_used: imageAnalysis.cnn_used
             }
         });
 
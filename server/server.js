@@ -9,8 +9,9 @@ const DynamoDBStore = require('connect-dynamodb')({ session: session });
 const { SignUp, SignIn, SpotifyDisconnect, AuthCheck, isAuthenticated } = require('./controllers/connect');
 const { FilterRequest, UploadPost } = require('./controllers/Getrequests');
 const { ResizeImage } = require('./controllers/resizeImage');
-const { enhanceImage } = require('./controllers/UpscaleImage');
+const { enhanceImage, upscaleStats, upscaleWorkerPool } = require('./controllers/UpscaleImage');
 const songRecommender = require('./controllers/songRecommender');
+const { analysisStats, analysisWorkerPool } = require('./controllers/SongRecComps/ImageAnalysis');
 const songRouter = require('./routes/songRoutes');
 const redisService = require('./services/redisService');
 const redisPreferencesService = require('./services/redisPreferencesService');
@@ -245,7 +246,9 @@ app.get('/health', (req, res) => {
     res.status(200).json({ 
         status: 'healthy', 
         timestamp: new Date().toISOString(),
-        service: 'image-editor-api'
+        service: 'image-editor-api',
+        upscale: upscaleStats(),
+        analysis: analysisStats()
     });
 });
 
@@ -267,6 +270,9 @@ let server;
 Promise.all([testDynamoDBConnection(), redisService.connect(), redisPreferencesService.connect()])
     .then(([dynamoConnected, _, __]) => {
         if (dynamoConnected) {
+            // Load the models now so the first upscale/analysis does not pay the cold start
+            upscaleWorkerPool.start();
+            analysisWorkerPool.start();
             server = app.listen(port, () => {
                 console.log(`Server running on port ${port}`);
                 console.log('Using DynamoDB as the database');
@@ -287,6 +293,8 @@ const gracefulShutdown = async () => {
     console.log('Received shutdown signal, starting graceful shutdown...');
     songRecommender.cleanup();
     songRouter.cleanup();
+    upscaleWorkerPool.stop();
+    analysisWorkerPool.stop();
     await redisService.disconnect();
     await redisPreferencesService.disconnect();
     if (server) {
@@ -0,0 +1,311 @@
+const { spawn } = require('child_process');
+
+// Frames are: uint32 header length, uint32 payload length (big-endian), JSON header, binary payload.
+// Must stay in sync with PythonScripts/worker_protocol.py.
+const FRAME_PREFIX_BYTES = 8;
+
+const encodeFrame = (header, payload = Buffer.alloc(0)) => {
+    const headerBuffer = Buffer.from(JSON.stringify(header), 'utf8');
+    const prefix = Buffer.alloc(FRAME_PREFIX_BYTES);
+    prefix.writeUInt32BE(headerBuffer.length, 0);
+    prefix.writeUInt32BE(payload.length, 4);
+    return [prefix, headerBuffer, payload];
+};
+
+class FrameDecoder {
+    constructor() {
+        this.chunks = [];
+        this.length = 0;
+    }
+
+    // Take `size` bytes off the front of the pending chunks without re-copying the whole backlog
+    _take(size) {
+        const parts = [];
+        let remaining = size;
+        while (remaining > 0) {
+            const chunk = this.chunks[0];
+            if (chunk.length <= remaining) {
+                parts.push(chunk);
+                this.chunks.shift();
+                remaining -= chunk.length;
+            } else {
+                parts.push(chunk.subarray(0, remaining));
+                this.chunks[0] = chunk.subarray(remaining);
+                remaining = 0;
+            }
+        }
+        this.length -= size;
+        return parts.length === 1 ? parts[0] : Buffer.concat(parts, size);
+    }
+
+    _peekPrefix() {
+        const prefix = this.chunks[0].length >= FRAME_PREFIX_BYTES
+            ? this.chunks[0]
+            : Buffer.concat(this.chunks, FRAME_PREFIX_BYTES);
+        return [prefix.readUInt32BE(0), prefix.readUInt32BE(4)];
+    }
+
+    push(chunk) {
+        this.chunks.push(chunk);
+        this.length += chunk.length;
+
+        const frames = [];
+        while (this.length >= FRAME_PREFIX_BYTES) {
+            const [headerLength, payloadLength] = this._peekPrefix();
+            if (this.length < FRAME_PREFIX_BYTES + headerLength + payloadLength) {
+                break;
+            }
+            this._take(FRAME_PREFIX_BYTES);
+            const header = JSON.parse(this._take(headerLength).toString('utf8'));
+            const payload = payloadLength ? this._take(payloadLength) : Buffer.alloc(0);
+            frames.push({ header, payload });
+        }
+        return frames;
+    }
+}
+
+class PythonWorkerPool {
+    // workerEnv(index) adds per-worker environment, e.g. a thread budget or CPU set; it is applied
+    // again when that worker is restarted.
+    // timeoutMs bounds each request from the moment it is queued (0 waits forever). After
+    // maxFailedStarts workers in a row exit before becoming ready, queued and new requests are
+    // rejected until a worker comes up; restarts keep going in the background.
+    constructor({ name, scriptPath, args = [], size = 1, maxInFlight = 1, env = {}, workerEnv = () => ({}),
+                  timeoutMs = 0, maxFailedStarts = 3 }) {
+        this.name = name;
+        this.scriptPath = scriptPath;
+        this.args = args;
+        this.size = Math.max(1, size);
+        this.maxInFlight = Math.max(1, maxInFlight);
+        this.env = env;
+        this.workerEnv = workerEnv;
+        this.timeoutMs = timeoutMs;
+        this.maxFailedStarts = Math.max(1, maxFailedStarts);
+        this.failedStarts = 0;
+        this.pythonPath = process.env.PYTHON_PATH || 'python';
+        this.workers = [];
+        this.queue = [];
+        this.nextRequestId = 1;
+        this.started = false;
+        this.stopping = false;
+    }
+
+    start() {
+        if (this.started) {
+            return;
+        }
+        this.started = true;
+        for (let index = 0; index < this.size; index++) {
+            this.workers.push(this._spawnWorker(index, 0));
+        }
+    }
+
+    stop() {
+        this.stopping = true;
+        for (const worker of this.workers) {
+            worker.process.stdin.end();
+        }
+    }
+
+    // onChunk(payload) receives the payloads of 'chunk' frames a worker streams before its final result
+    request(header, payload, { onChunk } = {}) {
+        this.start();
+        if (this._unavailable()) {
+            return Promise.reject(this._unavailableError());
+        }
+        return new Promise((resolve, reject) => {
+            const job = { header, payload, onChunk, settled: false };
+            job.resolve = (value) => this._settle(job, () => resolve(value));
+            job.reject = (error) => this._settle(job, () => reject(error));
+            if (this.timeoutMs > 0) {
+                job.timer = setTimeout(() => this._onTimeout(job), this.timeoutMs);
+            }
+            this.queue.push(job);
+            this._dispatch();
+        });
+    }
+
+    stats() {
+        return {
+            workers: this.workers.map(worker => ({
+                pid: worker.process.pid,
+                ready: worker.ready,
+                inFlight: worker.pending.size,
+                restarts: worker.restarts
+            })),
+            queued: this.queue.length,
+            failedStarts: this.failedStarts
+        };
+    }
+
+    _settle(job, settle) {
+        if (job.settled) {
+            return;
+        }
+        job.settled = true;
+        clearTimeout(job.timer);
+        settle();
+    }
+
+    _onTimeout(job) {
+        const error = new Error(`${this.name} request timed out after ${this.timeoutMs}ms`);
+        error.code = 'timeout';
+        const queued = this.queue.indexOf(job);
+        if (queued !== -1) {
+            this.queue.splice(queued, 1);
+        }
+        // A job already sent stays in its worker's pending map, so the slot stays taken until the
+        // worker answers; the late answer is then dropped
+        job.reject(error);
+    }
+
+    _unavailable() {
+        return this.failedStarts >= this.maxFailedStarts && !this.workers.some(worker => worker.ready);
+    }
+
+    _unavailableError() {
+        const error = new Error(`${this.name} workers failed to start ${this.failedStarts} times in a row`);
+        error.code = 'unavailable';
+        return error;
+    }
+
+    _spawnWorker(index, restarts) {
+        const child = spawn(this.pythonPath, [this.scriptPath, '--serve', ...this.args], {
+            env: { ...process.env, ...this.env, ...this.workerEnv(index) },
+            stdio: ['pipe', 'pipe', 'pipe']
+        });
+
+        const worker = {
+            index,
+            process: child,
+            decoder: new FrameDecoder(),
+            pending: new Map(),
+            ready: false,
+            everReady: false,
+            maxInFlight: this.maxInFlight,
+            restarts,
+            startedAt: Date.now()
+        };
+
+        child.stdout.on('data', (chunk) => {
+            let frames;
+            try {
+                frames = worker.decoder.push(chunk);
+            } catch (error) {
+                console.error(`${this.name} worker ${child.pid} sent a malformed frame:`, error);
+                child.kill();
+                return;
+            }
+            for (const frame of frames) {
+                this._onFrame(worker, frame);
+            }
+        });
+
+        child.stderr.on('data', (data) => {
+            console.error(`${this.name} worker ${child.pid}:`, data.toString().trimEnd());
+        });
+
+        child.stdin.on('error', (error) => {
+            console.error(`${this.name} worker ${child.pid} stdin error:`, error.message);
+        });
+
+        child.on('error', (error) => {
+            console.error(`Failed to spawn ${this.name} worker:`, error);
+        });
+
+        child.on('close', (code, signal) => this._onExit(worker, code, signal));
+
+        return worker;
+    }
+
+    _onFrame(worker, { header, payload }) {
+        if (header.type === 'ready') {
+            worker.ready = true;
+            worker.everReady = true;
+            this.failedStarts = 0;
+            // Workers that batch internally advertise how many requests they accept at once
+            worker.maxInFlight = Math.max(1, header.max_inflight || this.maxInFlight);
+            this._dispatch();
+            return;
+        }
+
+        const job = worker.pending.get(header.id);
+        if (!job) {
+            return;
+        }
+        if (header.type === 'chunk') {
+            if (job.onChunk && !job.settled) {
+                job.onChunk(payload);
+            }
+            return;
+        }
+        worker.pending.delete(header.id);
+
+        if (header.type === 'error') {
+            // Workers may tag errors with a machine-readable code and details (e.g. a cost estimate)
+            const error = new Error(header.error || `${this.name} worker failed`);
+            error.code = header.code;
+            error.details = header.estimate;
+            job.reject(error);
+        } else {
+            job.resolve({ header, payload });
+        }
+        this._dispatch();
+    }
+
+    _onExit(worker, code, signal) {
+        worker.ready = false;
+        const error = new Error(`${this.name} worker exited (code ${code}, signal ${signal})`);
+        for (const job of worker.pending.values()) {
+            job.reject(error);
+        }
+        worker.pending.clear();
+
+        if (this.stopping) {
+            return;
+        }
+
+        if (!worker.everReady) {
+            this.failedStarts++;
+            if (this._unavailable()) {
+                const unavailable = this._unavailableError();
+                for (const job of this.queue.splice(0)) {
+                    job.reject(unavailable);
+                }
+            }
+        }
+
+        // Restart with exponential backoff; a worker that stayed up for a minute starts over at 1s
+        const restarts = Date.now() - worker.startedAt > 60000 ? 0 : worker.restarts + 1;
+        const delay = Math.min(30000, 1000 * 2 ** Math.min(restarts, 5));
+        console.error(`${error.message}; restarting in ${delay}ms`);
+        setTimeout(() => {
+            if (!this.stopping) {
+                this.workers[worker.index] = this._spawnWorker(worker.index, restarts);
+            }
+        }, delay);
+    }
+
+    _dispatch() {
+        while (this.queue.length > 0) {
+            const worker = this.workers
+                .filter(candidate => candidate.ready && candidate.pending.size < candidate.maxInFlight)
+                .sort((a, b) => a.pending.size - b.pending.size)[0];
+            if (!worker) {
+                return;
+            }
+
+            const job = this.queue.shift();
+            if (job.settled) {
+                continue;
+            }
+            const id = this.nextRequestId++;
+            worker.pending.set(id, job);
+            for (const part of encodeFrame({ ...job.header, id }, job.payload)) {
+                worker.process.stdin.write(part);
+            }
+        }
+    }
+}
+
+module.exports = { PythonWorkerPool, FrameDecoder, encodeFrame };